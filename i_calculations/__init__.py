@@ -4,7 +4,12 @@ import json
 
 from yascheduler import Yascheduler
 
-from i_calculations.xrpd import get_pattern
+from i_calculations.xrpd import read_pattern
+from i_calculations.simulator import (
+    get_simulated_pattern,
+    check_simulation_params,
+    SIMULATION_DEFAULTS,
+)
 from i_data import Data_type
 from i_structures.topas import ase_to_topas
 from i_structures.fullprof import ase_to_fullprof
@@ -18,6 +23,14 @@ _scheduler_status_mapping = {
 
 SUPPORTED_ENGINES = ["dummy", "topas", "fullprof"]
 
+# computed right away, not via the scheduler
+LOCAL_ENGINES = {
+    "xrpd": get_simulated_pattern,
+}
+LOCAL_CHECKS = {
+    "xrpd": check_simulation_params,
+}
+
 
 class Calc_setup:
     schemata = {}
@@ -40,6 +53,15 @@ class Calc_setup:
         ) as f:
             templates[engine] = f.read()
 
+    for engine in LOCAL_ENGINES:
+        with open(
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "schemata/%s.json" % engine
+            ),
+            "r",
+        ) as f:
+            schemata[engine] = json.loads(f.read())
+
     def __init__(self):
         pass
 
@@ -79,6 +101,13 @@ class Calc_setup:
                 "merged" if kwargs.get("merged") else "calc.pcr": template
             }
 
+        elif engine in LOCAL_ENGINES:
+            result = {
+                "merged" if kwargs.get("merged") else "input": json.dumps(
+                    SIMULATION_DEFAULTS, indent=4
+                )
+            }
+
         else:
             result = {
                 "1.input": self.get_input("dummy"),
@@ -88,12 +117,38 @@ class Calc_setup:
 
         return result, error
 
+    def get_local_input(self, engine, user_input=None):
+        """
+        Parameters of a local engine, optionally overridden by the user
+
+        Returns:
+            dict *or* None
+            None *or* error (str)
+        """
+        if not user_input:
+            return {}, None
+
+        try:
+            params = json.loads(user_input)
+        except ValueError:
+            return None, "Invalid input definition"
+
+        if not isinstance(params, dict):
+            return None, "Invalid input definition"
+
+        if engine in LOCAL_CHECKS:
+            _, error = LOCAL_CHECKS[engine](params)
+            if error:
+                return None, error
+
+        return params, None
+
     def postprocess(self, engine, data_folder):
         output = dict(metadata={}, content=None, type=Data_type.property)
 
         parsers = {
-            "topas": get_pattern,
-            "fullprof": get_pattern,
+            "topas": read_pattern,
+            "fullprof": read_pattern,
         }
         default_parser = lambda x: {"content": 42}
         parser = parsers.get(engine, default_parser)
@@ -119,6 +174,7 @@ class Calc_setup:
 
         output["metadata"]["path"] = main_file_asset
         output["content"] = result["content"]
+        output["payload"] = result.get("payload")
         if result.get("type"):
             output["type"] = result["type"]
 
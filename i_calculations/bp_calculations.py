@@ -7,18 +7,19 @@ from yascheduler import Yascheduler
 
 from utils import (
     get_data_storage,
+    get_ase,
     fmt_msg,
     key_auth,
     webhook_auth,
     is_valid_uuid,
+    workers,
     WEBHOOK_KEY,
     WEBHOOK_CALC_UPDATE,
     WEBHOOK_CALC_CREATE,
 )
-from i_calculations import Calc_setup, _scheduler_status_mapping
+from i_calculations import Calc_setup, _scheduler_status_mapping, LOCAL_ENGINES
 from i_data import Data_type
 from i_structures import html_formula
-from i_structures.struct_utils import ase_unserialize
 
 
 bp_calculations = Blueprint("calculations", __name__, url_prefix="/calculations")
@@ -34,10 +35,11 @@ def create():
     """
     @api {post} /calculations/create create
     @apiGroup Calculations
-    @apiDescription Calculation start
+    @apiDescription Calculation start; the local engines (e.g. xrpd)
+    compute right away and give the resulting node instead of the calculation
 
     @apiParam {String} uuid Datasource
-    @apiParam {String} engine Use engine from those supported by scheduler
+    @apiParam {String} engine Use engine from those supported by scheduler or locally
     @apiParam {Object} [input] Params as per scheduler engines supported: {inputname: inputdata, ...}
     @apiParam {Boolean/String} [workflow] AiiDA integration
     """
@@ -46,7 +48,7 @@ def create():
         return fmt_msg("Empty or invalid request", 400)
 
     engine = request.values.get("engine")
-    if not engine or engine not in yac.config.engines:
+    if not engine or (engine not in yac.config.engines and engine not in LOCAL_ENGINES):
         return fmt_msg("Wrong engine requested", 400)
 
     workflow = request.values.get("workflow") == "workflow"
@@ -62,7 +64,23 @@ def create():
     if node["type"] != Data_type.structure:  # FIXME
         return fmt_msg("The item of this type cannot be used for calculation", 400)
 
-    ase_obj = ase_unserialize(node["content"])
+    ase_obj = get_ase(node)
+
+    if engine in LOCAL_ENGINES:
+        if workflow:
+            abort(501)
+
+        result, error = run_local_calc(db, node, ase_obj, engine, request.values.get("input"))
+        if error:
+            return fmt_msg(error, getattr(error, "status", 400))
+
+        current_app.logger.warning(f"Computed {engine} result {result['uuid']}")
+        return Response(
+            json.dumps(result, indent=4),
+            content_type="application/json",
+            status=200,
+        )
+
     input_data, error = setup.preprocess(ase_obj, engine, node["metadata"]["name"])
     if error:
         return fmt_msg(error, 503)
@@ -114,7 +132,6 @@ def create():
         )
         current_app.logger.warning(f"Submitted {engine} calculation {task_id}")
 
-    db.close()
     return Response(
         json.dumps(dict(uuid=new_uuid), indent=4),
         content_type="application/json",
@@ -199,14 +216,32 @@ def status():
                 "Scheduler and backend are out of sync, task(s) not scheduled", 500
             )
 
+    yac_items_mapping = {}
+    for item in yac_items:
+        if item["content"] in yac_items_mapping:
+            return fmt_msg("Internal error, task(s) lost", 500)
+        yac_items_mapping[item["content"]] = item
+
+    finished_tasks = [
+        task for task in yac_tasks
+        if task["status"] not in (Yascheduler.STATUS_TO_DO, Yascheduler.STATUS_RUNNING)
+    ]
+    sources = db.get_sources_many(
+        set(
+            yac_items_mapping[task["task_id"]]["metadata"]["parent"]
+            for task in finished_tasks if task["task_id"] in yac_items_mapping
+        ),
+        fields=("type",),
+    ) if finished_tasks else {}
+
     for task in yac_tasks:
-        found = [item for item in yac_items if item["content"] == task["task_id"]]
-        if not found or len(found) > 1:
+        found = yac_items_mapping.get(task["task_id"])
+        if not found:
             return fmt_msg("Internal error, task(s) lost", 500)
 
-        calc_uuid =   found[0]["uuid"]
-        calc_name =   found[0]["metadata"]["name"]
-        calc_parent = found[0]["metadata"]["parent"]
+        calc_uuid =   found["uuid"]
+        calc_name =   found["metadata"]["name"]
+        calc_parent = found["metadata"]["parent"]
 
         if task["status"] == Yascheduler.STATUS_TO_DO:
             progress = _scheduler_status_mapping[task["status"]]
@@ -215,7 +250,7 @@ def status():
             progress = _scheduler_status_mapping[task["status"]]
 
         else:
-            if not db.get_sources(calc_parent):
+            if not sources.get(calc_parent):
                 # Should we handle results here? TODO?
                 current_app.logger.critical("Listing precedes hook")
 
@@ -229,8 +264,6 @@ def status():
             progress=progress,
         )
 
-    db.close()
-
     results = []
     if results_mapping:
         # sort according to unique sequence requested
@@ -322,7 +355,7 @@ def update():
             result = None
 
             error = None
-            if not db.get_sources(item["metadata"]["parent"]):
+            if not db.get_sources(item["metadata"]["parent"], fields=("type",)):
                 result, error = process_calc(db, item, task_id)
 
             if error:
@@ -355,7 +388,6 @@ def update():
     else:
         current_app.logger.error("No calc for task %s" % task_id)
 
-    db.close()
     return Response("", status=204)
 
 
@@ -394,14 +426,13 @@ def template():
 
     db = get_data_storage()
     node = db.get_item(uuid)
-    db.close()
     if not node:
         return fmt_msg("No such content", 400)
 
     if node["type"] != Data_type.structure:
         return fmt_msg("The item of this type cannot be used for calculation", 400)
 
-    ase_obj = ase_unserialize(node["content"])
+    ase_obj = get_ase(node)
     input_data, error = setup.preprocess(ase_obj, engine, node["metadata"]["name"], merged=True)
     if error:
         return fmt_msg(error, 503)
@@ -421,10 +452,11 @@ def supported():
     @api {get} /calculations/supported supported
     @apiGroup Calculations
     @apiDescription Get list of the supported scheduler engines, e.g.
-    ["dummy", "dummy+workflow", "pcrystal", "pcrystal+workflow", "gulp", "topas"]
+    ["dummy", "dummy+workflow", "pcrystal", "pcrystal+workflow", "gulp", "topas"],
+    followed by the local engines
     """
     return Response(
-        json.dumps(list(yac.config.engines.keys())),
+        json.dumps(list(yac.config.engines.keys()) + list(LOCAL_ENGINES)),
         content_type="application/json",
         status=200,
     )
@@ -447,7 +479,9 @@ def process_calc(db, calc_row, scheduler_id):
     output["metadata"]["engine"] = calc_row["metadata"]["engine"]
     output["metadata"]["name"] = calc_row["metadata"]["name"] + " result"
 
-    new_uuid = db.put_item(output["metadata"], output["content"], output["type"])
+    new_uuid = db.put_item(
+        output["metadata"], output["content"], output["type"], payload=output.get("payload")
+    )
     result = {"uuid": new_uuid, "parent": calc_row["metadata"]["parent"]}
 
     try:
@@ -462,3 +496,34 @@ def process_calc(db, calc_row, scheduler_id):
     db.drop_item(calc_row["uuid"])
 
     return result, None
+
+
+def run_local_calc(db, node, ase_obj, engine, user_input=None):
+    """
+    Compute with a local engine in a worker process, without the scheduler,
+    and save the result just as process_calc does
+
+    Returns:
+        dict of uuid, parent, and type *or* None
+        None *or* error (str)
+    """
+    params, error = setup.get_local_input(engine, user_input)
+    if error:
+        return None, error
+
+    output, error = workers.run(
+        LOCAL_ENGINES[engine], ase_obj, params, task="Local %s calculation" % engine
+    )
+    if error:
+        return None, error
+
+    new_uuid = db.put_item(
+        dict(name=node["metadata"]["name"] + " result", engine=engine),
+        output["content"],
+        output["type"],
+        payload=output.get("payload"),
+    )
+    if not db.put_link(node["uuid"], new_uuid):
+        return None, "Graph edge consistency error (no source %s ?)" % node["uuid"]
+
+    return {"uuid": new_uuid, "parent": node["uuid"], "type": output["type"]}, None
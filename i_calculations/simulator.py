@@ -0,0 +1,241 @@
+"""
+A quick theoretical XRPD pattern of a structure, computed in numpy,
+for a preview without an external engine: the reflections are
+enumerated from the cell, their structure factors are summed over the atoms,
+and the peaks are broadened with the pseudo-Voigt profile;
+NB no anomalous scattering, absorption, preferred orientation etc.
+"""
+import numpy as np
+
+from i_calculations.xrpd import make_pattern
+
+
+SIMULATION_DEFAULTS = dict(
+    wavelength=1.540596,  # Cu Ka1, as in the TOPAS template
+    two_theta_min=10.0,
+    two_theta_max=175.0,
+    step=0.01,
+    caglioti_u=0.005865,  # FWHM, as in the FullProf template
+    caglioti_v=0.025089,
+    caglioti_w=0.018587,
+    eta=0.5,  # Lorentzian fraction
+    b_iso=0.5,  # isotropic temperature factor, A^2
+)
+# inclusive, see also schemata/xrpd.json
+SIMULATION_LIMITS = dict(
+    wavelength=(0.1, 5.0),
+    two_theta_min=(1.0, 179.0),
+    two_theta_max=(1.0, 179.0),
+    step=(0.001, 1.0),
+    caglioti_u=(0.0, 10.0),
+    caglioti_v=(-10.0, 10.0),
+    caglioti_w=(0.0, 10.0),
+    eta=(0.0, 1.0),
+    b_iso=(0.0, 20.0),
+)
+MAX_REFLECTIONS = 200000
+MAX_FWHM = 5.0  # degrees
+PROFILE_WIDTH = 10  # FWHMs each side of a peak
+PROFILE_BUDGET = 2 ** 20  # points of the profiles computed at once
+CHUNK_SIZE = 4096
+
+
+def get_reflections(cell, wavelength, two_theta_max):
+    """
+    Miller indices of the reflections within the 2theta range,
+    only one of each Friedel pair, as they have the same intensity
+
+    Returns:
+        hkl (int array N x 3) *or* None
+        None *or* error (str)
+    """
+    reciprocal = np.linalg.inv(cell).T  # rows, no 2pi
+    g_max = 2 * np.sin(np.radians(two_theta_max) / 2) / wavelength
+
+    # NB |h| <= |G| |a|, as h = G . a
+    limits = np.floor(g_max * np.linalg.norm(cell, axis=1)).astype(int)
+    if np.prod(2 * limits + 1) > MAX_REFLECTIONS * 4:
+        return None, "Unit cell is too large for the quick simulation"
+
+    hkl = np.stack(
+        np.meshgrid(*(np.arange(-limit, limit + 1) for limit in limits), indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+
+    # the first nonzero index is positive
+    first = np.where(hkl[:, 0] != 0, hkl[:, 0], np.where(hkl[:, 1] != 0, hkl[:, 1], hkl[:, 2]))
+    hkl = hkl[first > 0]
+
+    g = np.linalg.norm(hkl @ reciprocal, axis=1)
+    hkl = hkl[(g > 0) & (g <= g_max)]
+    if len(hkl) > MAX_REFLECTIONS:
+        return None, "Unit cell is too large for the quick simulation"
+
+    return hkl, None
+
+
+def get_intensities(ase_obj, hkl, wavelength, b_iso):
+    """
+    Squared structure factors, the atomic form factors being approximated
+    by the atomic numbers, damped by the isotropic temperature factor
+
+    Returns:
+        2theta (array), intensity (array)
+    """
+    reciprocal = np.linalg.inv(ase_obj.cell[:]).T
+    s = np.linalg.norm(hkl @ reciprocal, axis=1) / 2  # sin(theta) / lambda
+    two_theta = 2 * np.degrees(np.arcsin(np.clip(s * wavelength, 0, 1)))
+
+    numbers = ase_obj.get_atomic_numbers().astype(float)
+    positions = ase_obj.get_scaled_positions()
+    intensity = np.empty(len(hkl))
+
+    for start in range(0, len(hkl), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        phases = 2 * np.pi * (hkl[chunk] @ positions.T)
+        factor = np.exp(-b_iso * s[chunk] ** 2)[:, None] * numbers[None, :]
+        intensity[chunk] = (
+            np.sum(factor * np.cos(phases), axis=1) ** 2
+            + np.sum(factor * np.sin(phases), axis=1) ** 2
+        )
+
+    return two_theta, intensity
+
+
+def merge_reflections(two_theta, intensity, decimals=4):
+    """
+    The reflections at the same 2theta are merged into a line,
+    the number of the merged ones being its multiplicity
+
+    Returns:
+        2theta (array), intensity (array), multiplicity (array)
+    """
+    lines, inverse, counts = np.unique(
+        np.round(two_theta, decimals), return_inverse=True, return_counts=True
+    )
+    # NB each Friedel pair is counted twice
+    return lines, np.bincount(inverse, weights=intensity) * 2, counts * 2
+
+
+def pseudo_voigt(x, centers, fwhm, eta):
+    """
+    Area-normalized profiles of the peaks
+
+    Args:
+        x: (array) points around each peak, one row per peak
+    """
+    half = fwhm[:, None] / 2
+    offsets = (x - centers[:, None]) / half
+    gauss = np.sqrt(np.log(2) / np.pi) / half * np.exp(-np.log(2) * offsets ** 2)
+    lorentz = 1 / (np.pi * half) / (1 + offsets ** 2)
+    return eta * lorentz + (1 - eta) * gauss
+
+
+def check_simulation_params(params):
+    """
+    Args:
+        params: (dict) see SIMULATION_DEFAULTS, possibly partial
+
+    Returns:
+        all the params as floats (dict) *or* None
+        None *or* error (str)
+    """
+    unknown = set(params) - set(SIMULATION_DEFAULTS)
+    if unknown:
+        return None, "Unknown simulation parameter(s): %s" % ", ".join(sorted(unknown))
+
+    params = dict(SIMULATION_DEFAULTS, **params)
+    try:
+        params = {key: float(value) for key, value in params.items()}
+    except (TypeError, ValueError):
+        return None, "Simulation parameters must be numbers"
+
+    if not (
+        all(low <= params[key] <= high for key, (low, high) in SIMULATION_LIMITS.items())
+        and params["two_theta_min"] < params["two_theta_max"]
+    ):
+        return None, "Simulation parameters are out of range"
+
+    return params, None
+
+
+def simulate_pattern(ase_obj, **params):
+    """
+    Theoretical XRPD pattern
+
+    Args:
+        ase_obj: (object) ASE structure
+        params: see SIMULATION_DEFAULTS
+
+    Returns:
+        x, y (arrays) *or* None
+        None *or* error (str)
+    """
+    params, error = check_simulation_params(params)
+    if error:
+        return None, error
+
+    if not len(ase_obj) or not ase_obj.cell.volume:
+        return None, "Structure is not periodic"
+
+    hkl, error = get_reflections(ase_obj.cell[:], params["wavelength"], params["two_theta_max"])
+    if error:
+        return None, error
+
+    lines, intensity, _ = merge_reflections(
+        *get_intensities(ase_obj, hkl, params["wavelength"], params["b_iso"])
+    )
+
+    # Lorentz-polarization factor
+    theta = np.radians(lines) / 2
+    intensity *= (1 + np.cos(2 * theta) ** 2) / (np.sin(theta) ** 2 * np.cos(theta))
+
+    tan = np.tan(theta)
+    fwhm = np.sqrt(
+        np.clip(
+            params["caglioti_u"] * tan ** 2 + params["caglioti_v"] * tan + params["caglioti_w"],
+            1e-6,
+            MAX_FWHM ** 2,
+        )
+    )
+
+    x = np.arange(params["two_theta_min"], params["two_theta_max"] + params["step"] / 2, params["step"])
+    y = np.zeros(len(x))
+
+    # NB only a window of the pattern is computed around each peak,
+    # and only so many peaks at once, as the memory allows
+    starts = np.searchsorted(x, lines - PROFILE_WIDTH * fwhm)
+    ends = np.searchsorted(x, lines + PROFILE_WIDTH * fwhm)
+    width = int((ends - starts).max(initial=0))
+    if width:
+        chunk_size = max(1, PROFILE_BUDGET // width)
+        for start in range(0, len(lines), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            index = starts[chunk, None] + np.arange(width)[None, :]
+            mask = index < ends[chunk, None]
+            index = np.minimum(index, len(x) - 1)
+            profiles = pseudo_voigt(x[index], lines[chunk], fwhm[chunk], params["eta"])
+            y += np.bincount(
+                index[mask], weights=(profiles * intensity[chunk, None])[mask], minlength=len(x)
+            )
+
+    return (x, y), None
+
+
+def get_simulated_pattern(ase_obj, params):
+    """
+    Theoretical XRPD pattern as the node data, see get_pattern;
+    to be run in a worker process
+
+    Returns:
+        dict of content, type, and payload *or* None
+        None *or* error (str)
+    """
+    columns, error = simulate_pattern(ase_obj, **params)
+    if error:
+        return None, error
+
+    result = make_pattern(*columns)
+    if not result:
+        return None, "No reflections within the 2theta range"
+
+    return result, None
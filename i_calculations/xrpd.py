@@ -1,49 +1,376 @@
+import gc
+import zlib
+import struct
 import random
 import string
+import warnings
+
+import numpy as np
 
 from i_data import Data_type
 
 
-def get_pattern(resource):
+MAX_PATTERN_POINTS = 2000
+DECIMATION_TOLERANCE = 0.005  # of the integrated intensity, see tests/stress/bench_xrpd.py
+DECIMATION_STEP = 8  # at most 1/8 of the points is dropped at once
+FLAT_BUCKET_SPREAD = 0.005  # of the max intensity
+
+PATTERN_SCALE = 200  # max intensity
+PATTERN_DECIMALS = (5, 3)  # of 2theta and intensity in JSON, within float32 precision
+PATTERN_MAGIC = b"XRPD"
+PATTERN_VERSION = 1
+PATTERN_ZLIB = 1
+PATTERN_COMPRESSION_GAIN = 0.75  # max compressed to raw size ratio
+PATTERN_HEADER = struct.Struct("<4sBBxxI")  # magic, version, flags, number of points
+
+SIMILARITY_GRID = np.linspace(5, 120, 1151)  # 2theta, 0.1 degree step
+SIMILARITY_SMOOTHING = 0.15  # degrees 2theta, so that the slightly shifted peaks still overlap
+
+
+def read_pattern_lines(path):
     """
-    Check if a file / given string contains computed XRPD pattern
-    (basicaly, two columns of floats)
-    TODO
-    process large patterns in-place leaving only their integral feature
+    Lines of a file, until the FullProf END marker
     """
-    output = []
+    with open(path) as f:
+        text = f.read()
+    lines = text.split("\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    return cut_pattern_lines(text, lines)
 
-    try:
-        f = open(resource)
-    except OSError:
-        for line in resource.splitlines():
+
+def split_pattern_lines(text):
+    """
+    Lines of a given string, until the FullProf END marker;
+    NB never taken for a path, as it may come from a user
+    """
+    return cut_pattern_lines(text, text.splitlines())
+
+
+def cut_pattern_lines(text, lines):
+    if "END" in text:
+        for n, line in enumerate(lines):
             if line.startswith("END"): # FullProf fmt
-                break
-            try:
-                output.append([float(item) for item in line.split(maxsplit=1)])
-            except ValueError:
-                continue
+                return lines[:n]
+    return lines
+
+
+def parse_pattern_line(line):
+    """
+    Returns:
+        floats (list), possibly not two of them *or* None, if the line is to be skipped
+    """
+    try:
+        return [float(item) for item in line.split(maxsplit=1)]
+    except ValueError:
+        return None
+
+
+def parse_pattern_lines(lines):
+    """
+    Two columns of floats as arrays, or None, if there are no such;
+    the lines of other kinds are skipped, but the empty or one-column lines
+    are not tolerated (as it was always the case)
+    """
+    # NB the C parser handles the regular data in one go,
+    # so only the headers and footers are skipped beforehand
+    start, end = 0, len(lines)
+    while start < end and parse_pattern_line(lines[start]) is None:
+        start += 1
+    while end > start and parse_pattern_line(lines[end - 1]) is None:
+        end -= 1
+
+    if start == end:
+        return None
+
+    try:
+        with warnings.catch_warnings():
+            # NB the whitespace-only lines are given as no data, and are rejected below
+            warnings.simplefilter("ignore", UserWarning)
+            data = np.loadtxt(lines[start:end], dtype=float, comments=None, ndmin=2)
+    except ValueError:
+        data = None
+
+    if data is not None and data.shape == (end - start, 2):
+        return data[:, 0], data[:, 1]
+
+    # the malformed lines in between are skipped one by one
+    output = [item for item in map(parse_pattern_line, lines[start:end]) if item is not None]
+
+    if not output or any(len(item) != 2 for item in output):
+        return None
+
+    data = np.array(output, dtype=float)
+    return data[:, 0], data[:, 1]
+
+
+def integrate(x, y):
+    return np.sum((y[1:] + y[:-1]) * np.diff(x)) / 2
+
+
+def removal_areas(x, y):
+    """
+    Signed change of the integrated intensity, if each inner point is removed,
+    i.e. the area of the triangle it makes with its neighbours
+    """
+    x0, x1, x2 = x[:-2], x[1:-1], x[2:]
+    y0, y1, y2 = y[:-2], y[1:-1], y[2:]
+    return ((x1 - x0) * (y1 + y0) + (x2 - x1) * (y2 + y1) - (x2 - x0) * (y2 + y0)) / 2
+
+
+def decimate_pattern(x, y, target=MAX_PATTERN_POINTS):
+    """
+    Area-preserving decimation, as by Visvalingam-Whyatt, but in the vectorized rounds:
+    the points of the smallest triangles with their neighbours are removed,
+    so that the peaks and their shoulders survive; NB no two neighbours
+    are removed in one round, so that their areas add up exactly, and the removed
+    areas of either sign are balanced, so that the integrated intensity
+    is kept within DECIMATION_TOLERANCE; the maxima of the non-flat buckets
+    are never removed, so that the peak heights are kept as well
+
+    Returns:
+        decimated x, y (arrays), at most max(target, 2) points
+    """
+    count = len(x)
+    if count <= target:
+        return x, y
+
+    fixed = np.zeros(count, dtype=bool)
+    buckets = min(count, max(1, target // 4))
+    bounds = np.linspace(0, count, buckets + 1).astype(int)
+    size = int(np.diff(bounds).max())
+    index = np.minimum(bounds[:-1, None] + np.arange(size)[None, :], bounds[1:, None] - 1)
+    highs = index[np.arange(buckets), np.argmax(y[index], axis=1)]
+    spread = y[highs] - np.minimum.reduceat(y, bounds[:-1])
+    fixed[highs[spread > FLAT_BUCKET_SPREAD * (np.abs(y).max() or 1.0)]] = True
+
+    keep, error = np.arange(count), 0.0
+    while len(keep) > target:
+        signed = removal_areas(x[keep], y[keep])
+        areas = np.abs(signed)
+        areas[fixed[keep[1:-1]]] = np.inf
+
+        # the local minima only, thus never the neighbours
+        padded = np.concatenate([[np.inf], areas, [np.inf]])
+        candidates = np.flatnonzero((areas < padded[:-2]) & (areas <= padded[2:]))
+        num = min(len(keep) - target, max(1, len(keep) // DECIMATION_STEP), len(candidates))
+        if num < 1:
+            break
+
+        if len(candidates) > num:
+            # out of the twice as many smallest, as many positive and negative ones are taken,
+            # as the total error is the lowest
+            pool = min(len(candidates), 2 * num)
+            candidates = candidates[np.argpartition(areas[candidates], pool - 1)[:pool]]
+            candidates = candidates[np.argsort(areas[candidates], kind="stable")]
+            positive = candidates[signed[candidates] > 0]
+            negative = candidates[signed[candidates] <= 0]
+            sums = (
+                np.concatenate([[0], np.cumsum(signed[positive])]),
+                np.concatenate([[0], np.cumsum(signed[negative])]),
+            )
+            taken = np.arange(max(0, num - len(negative)), min(num, len(positive)) + 1)
+            taken = taken[np.argmin(np.abs(error + sums[0][taken] + sums[1][num - taken]))]
+            candidates = np.concatenate([positive[:taken], negative[:num - taken]])
+
+        error += signed[candidates].sum()
+
+        # NB the edges are always kept
+        mask = np.ones(len(keep), dtype=bool)
+        mask[candidates + 1] = False
+        keep = keep[mask]
+
+    return x[keep], y[keep]
+
+
+def pattern_serialize(x, y, compress=True):
+    """
+    Full-resolution pattern, as stored in the node payload:
+    the header, then the float32 columns of 2theta and intensity,
+    optionally zlib-compressed as a whole, if that pays off
+    (the noisy experimental intensities hardly compress)
+
+    Returns:
+        packed pattern (bytes)
+    """
+    x, y = np.asarray(x, dtype="<f4"), np.asarray(y, dtype="<f4")
+    body = x.tobytes() + y.tobytes()
+    flags = 0
+    if compress:
+        compressed = zlib.compress(body)
+        if len(compressed) <= len(body) * PATTERN_COMPRESSION_GAIN:
+            body = compressed
+            flags |= PATTERN_ZLIB
+    return PATTERN_HEADER.pack(PATTERN_MAGIC, PATTERN_VERSION, flags, len(x)) + body
+
+
+def is_packed_pattern(data):
+    return bool(data) and bytes(data[:len(PATTERN_MAGIC)]) == PATTERN_MAGIC
+
 
+def pattern_size(data):
+    """
+    Number of points in the packed pattern
+    """
+    return PATTERN_HEADER.unpack_from(data)[3]
+
+
+def inflate(stream, data, size):
+    """
+    Exactly the given number of the decompressed bytes, unless the stream ends
+    """
+    # NB zero max_length would mean no limit
+    return stream.decompress(data, size) if size else b""
+
+
+def pattern_unserialize(data, xmin=None, xmax=None):
+    """
+    Decode the packed pattern, optionally only its 2theta window;
+    NB the compressed stream is inflated no further than the window end
+
+    Returns:
+        x, y (float32 arrays)
+
+    Raises:
+        ValueError
+    """
+    if not is_packed_pattern(data):
+        raise ValueError("Not a packed pattern")
+
+    _, version, flags, count = PATTERN_HEADER.unpack_from(data)
+    if version != PATTERN_VERSION:
+        raise ValueError("Unsupported pattern version %s" % version)
+
+    width = np.dtype("<f4").itemsize
+    body = memoryview(data)[PATTERN_HEADER.size:]
+
+    if flags & PATTERN_ZLIB:
+        stream = zlib.decompressobj()
+        x = np.frombuffer(inflate(stream, body, count * width), dtype="<f4")
     else:
-        while True:
-            line = f.readline()
-            if not line or line.startswith("END"): # FullProf fmt
-                break
-            try:
-                output.append([float(item) for item in line.split(maxsplit=1)])
-            except ValueError:
-                continue
-        f.close()
+        x = np.frombuffer(body, dtype="<f4", count=count)
+
+    if len(x) != count:
+        raise ValueError("Truncated pattern")
+
+    start = 0 if xmin is None else int(np.searchsorted(x, xmin, side="left"))
+    end = count if xmax is None else int(np.searchsorted(x, xmax, side="right"))
+    end = max(start, end)
+
+    if flags & PATTERN_ZLIB:
+        inflate(stream, stream.unconsumed_tail, start * width)
+        y = np.frombuffer(inflate(stream, stream.unconsumed_tail, (end - start) * width), dtype="<f4")
+    else:
+        y = np.frombuffer(body, dtype="<f4", count=end - start, offset=(count + start) * width)
+
+    if len(y) != end - start:
+        raise ValueError("Truncated pattern")
+
+    return x[start:end], y
+
+
+def get_pattern(content):
+    """
+    Check if a given string contains computed XRPD pattern
+    (basicaly, two columns of floats);
+    the content holds the pattern decimated for display,
+    the payload holds its full resolution;
+    NB the string is never taken for a path, see read_pattern
+
+    Returns:
+        dict of content, type, and payload *or* None
+    """
+    columns = parse_pattern_lines(split_pattern_lines(content))
+    if columns is None:
+        return None
+
+    return make_pattern(*columns)
+
+
+def read_pattern(path):
+    """
+    Same as get_pattern, but for a file, e.g. an engine output
+
+    Returns:
+        dict of content, type, and payload *or* None
+    """
+    try:
+        lines = read_pattern_lines(path)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    columns = parse_pattern_lines(lines)
+    if columns is None:
+        return None
+
+    return make_pattern(*columns)
+
+
+def make_pattern(x, y):
+    """
+    Normalize the pattern columns into the node data, see get_pattern
+    """
+    ymax = y.max() # normalize
+    if not np.isfinite(ymax) or not ymax:
+        return None
+
+    y = y / ymax * PATTERN_SCALE
+    if np.any(np.diff(x) < 0):
+        order = np.argsort(x, kind="stable")
+        x, y = x[order], y[order]
+
+    return dict(
+        content=pattern_to_list(*decimate_pattern(x, y)),
+        type=Data_type.pattern,
+        payload=pattern_serialize(x, y),
+    )
+
+
+def pattern_to_list(x, y):
+    """
+    The [[x, y], ...] pairs, as the patterns are represented in JSON
+    """
+    x = np.round(x.astype(float), PATTERN_DECIMALS[0])
+    y = np.round(y.astype(float), PATTERN_DECIMALS[1])
+
+    # NB millions of the small lists would trigger the garbage collector in vain
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(map(list, zip(x.tolist(), y.tolist())))
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def project_pattern(x, y, grid=SIMILARITY_GRID, smoothing=SIMILARITY_SMOOTHING):
+    """
+    The pattern as a unit vector on the fixed 2theta grid, for the similarity search:
+    the intensity is integrated within the grid bins, so that no sharp peak
+    falls between the grid points, and then smoothed with a gaussian
+
+    Returns:
+        vector (float32 array) *or* None, if nothing is within the grid
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    step = grid[1] - grid[0]
 
-    if output:
+    widths = np.abs(np.gradient(x)) if len(x) > 1 else np.ones(len(x))
+    index = np.rint((x - grid[0]) / step).astype(int)
+    mask = (index >= 0) & (index < len(grid)) & np.isfinite(y)
+    vector = np.bincount(index[mask], weights=(y * widths)[mask], minlength=len(grid))
 
-        try: ymax = max([y for _, y in output]) # normalize
-        except ValueError: return None
+    if smoothing:
+        half = int(np.ceil(3 * smoothing / step))
+        kernel = np.exp(-((np.arange(-half, half + 1) * step) ** 2) / (2 * smoothing ** 2))
+        vector = np.convolve(vector, kernel / kernel.sum(), mode="same")
 
-        output = [[x, int(round(y / ymax * 200))] for x, y in output]
-        return dict(content=output, type=Data_type.pattern)
+    vector = np.clip(vector, 0, None)
+    norm = np.linalg.norm(vector)
+    if not np.isfinite(norm) or not norm:
+        return None
 
-    return None
+    return (vector / norm).astype(np.float32)
 
 
 def get_pattern_name():
@@ -58,7 +385,7 @@ if __name__ == "__main__":
     import os, sys
 
     for item in os.listdir(sys.argv[1]):
-        result = get_pattern(os.path.join(sys.argv[1], item))
+        result = read_pattern(os.path.join(sys.argv[1], item))
         if result:
             print(item, len(result.get("content")))
         else:
@@ -4,13 +4,22 @@ only a few Postgres tables are used;
 of course we use SQL here only and nowhere else
 """
 import json
+from copy import deepcopy
+from uuid import uuid4, UUID
 
 import pg8000
 
 
+BULK_CHUNK_SIZE = 1000
+MAX_LINEAGE_DEPTH = 100
+MAX_PAGE_SIZE = 500
+
+NODE_FIELDS = ("metadata", "content", "type", "payload")
+
 NODE_TABLE = "backend_data_nodes"
 LINK_TABLE = "backend_data_links"
 PHASE_TABLE = "distinct_phases"
+REFINED_TABLE = "refined_structures"
 
 
 class Data_type:
@@ -21,110 +30,374 @@ class Data_type:
     pattern = 5
 
 
+# these are never modified after saving, so can be cached
+IMMUTABLE_TYPES = (Data_type.structure, Data_type.property, Data_type.pattern)
+
+
+STATEMENTS = dict(
+    put_item="""
+    INSERT INTO {NODE_TABLE} (metadata, content, type, payload, fingerprint)
+    VALUES (:metadata, :content, :type, :payload, :fingerprint) RETURNING item_id;
+    """,
+    put_items="""
+    INSERT INTO {NODE_TABLE} (item_id, metadata, content, type, payload, fingerprint) SELECT * FROM UNNEST(
+        :uuids::uuid[], :metadata::jsonb[], :contents::varchar[], :types::smallint[], :payloads::bytea[],
+        :fingerprints::char(40)[]
+    );
+    """,
+    put_link="""
+    INSERT INTO {LINK_TABLE} (source_id, target_id) VALUES (:source_uuid, :target_uuid);
+    """,
+    put_links="""
+    INSERT INTO {LINK_TABLE} (source_id, target_id)
+    SELECT * FROM UNNEST(:source_uuids::uuid[], :target_uuids::uuid[])
+    ON CONFLICT DO NOTHING RETURNING source_id, target_id;
+    """,
+    get_item="""
+    SELECT item_id, {FIELDS} FROM {NODE_TABLE} WHERE item_id = :uuid;
+    """,
+    get_links="""
+    SELECT NULL, target_id FROM {LINK_TABLE} WHERE source_id = :uuid
+    UNION ALL
+    SELECT source_id, NULL FROM {LINK_TABLE} WHERE target_id = :uuid;
+    """,
+    get_items="""
+    SELECT item_id, {FIELDS} FROM {NODE_TABLE} WHERE item_id = ANY(:uuids);
+    """,
+    get_items_links="""
+    SELECT source_id, NULL, target_id FROM {LINK_TABLE} WHERE source_id = ANY(:uuids)
+    UNION ALL
+    SELECT target_id, source_id, NULL FROM {LINK_TABLE} WHERE target_id = ANY(:uuids);
+    """,
+    get_sources="""
+    SELECT item_id, {FIELDS} FROM {NODE_TABLE} WHERE item_id IN (
+        SELECT source_id FROM {LINK_TABLE} WHERE target_id = :uuid
+    );
+    """,
+    get_sources_many="""
+    SELECT links.target_id, item_id, {FIELDS} FROM {LINK_TABLE} links
+    JOIN {NODE_TABLE} ON item_id = links.source_id
+    WHERE links.target_id = ANY(:uuids);
+    """,
+    get_lineage="""
+    WITH RECURSIVE ancestors(item_id, depth, path) AS (
+        SELECT item_id, 0, ARRAY[item_id] FROM {NODE_TABLE} WHERE item_id = ANY(:uuids::uuid[])
+        UNION ALL
+        SELECT links.source_id, ancestors.depth + 1, ancestors.path || links.source_id FROM ancestors
+        JOIN {LINK_TABLE} links ON links.target_id = ancestors.item_id
+        JOIN {NODE_TABLE} nodes ON nodes.item_id = links.source_id
+        WHERE :ancestors AND ancestors.depth < :depth
+        AND NOT links.source_id = ANY(ancestors.path)
+        AND (cardinality(:types::smallint[]) = 0 OR nodes.type = ANY(:types::smallint[]))
+    ), descendants(item_id, depth, path) AS (
+        SELECT item_id, 0, ARRAY[item_id] FROM {NODE_TABLE} WHERE item_id = ANY(:uuids::uuid[])
+        UNION ALL
+        SELECT links.target_id, descendants.depth + 1, descendants.path || links.target_id FROM descendants
+        JOIN {LINK_TABLE} links ON links.source_id = descendants.item_id
+        JOIN {NODE_TABLE} nodes ON nodes.item_id = links.target_id
+        WHERE :descendants AND descendants.depth < :depth
+        AND NOT links.target_id = ANY(descendants.path)
+        AND (cardinality(:types::smallint[]) = 0 OR nodes.type = ANY(:types::smallint[]))
+    ), subgraph AS (
+        SELECT item_id FROM ancestors UNION SELECT item_id FROM descendants
+    )
+    SELECT item_id, metadata, type, NULL::uuid, NULL::uuid FROM {NODE_TABLE}
+    WHERE item_id IN (SELECT item_id FROM subgraph)
+    UNION ALL
+    SELECT NULL, NULL, NULL, source_id, target_id FROM {LINK_TABLE}
+    WHERE source_id IN (SELECT item_id FROM subgraph) AND target_id IN (SELECT item_id FROM subgraph);
+    """,
+    browse_items="""
+    SELECT item_id, metadata, type, created_at FROM {NODE_TABLE}
+    WHERE type = :type AND (created_at, item_id) > (:created_at::timestamp, :after::uuid)
+    ORDER BY created_at, item_id LIMIT :limit;
+    """,
+    iter_items="""
+    SELECT item_id, {FIELDS} FROM {NODE_TABLE}
+    WHERE type = :type AND item_id > :after ORDER BY item_id LIMIT :limit;
+    """,
+    update_payloads="""
+    UPDATE {NODE_TABLE} SET payload = data.payload, content = NULL
+    FROM UNNEST(:uuids::uuid[], :payloads::bytea[]) AS data(item_id, payload)
+    WHERE {NODE_TABLE}.item_id = data.item_id;
+    """,
+    update_patterns="""
+    UPDATE {NODE_TABLE} SET content = data.content, payload = data.payload
+    FROM UNNEST(:uuids::uuid[], :contents::varchar[], :payloads::bytea[])
+        AS data(item_id, content, payload)
+    WHERE {NODE_TABLE}.item_id = data.item_id;
+    """,
+    update_fingerprints="""
+    UPDATE {NODE_TABLE} SET fingerprint = data.fingerprint
+    FROM UNNEST(:uuids::uuid[], :fingerprints::char(40)[]) AS data(item_id, fingerprint)
+    WHERE {NODE_TABLE}.item_id = data.item_id;
+    """,
+    search_fingerprints="""
+    SELECT DISTINCT ON (fingerprint) fingerprint, item_id, metadata, type FROM {NODE_TABLE}
+    WHERE fingerprint = ANY(:fingerprints::char(40)[]) AND type = :type
+    ORDER BY fingerprint, created_at, item_id;
+    """,
+    put_phases="""
+    INSERT INTO {PHASE_TABLE} (elements, formula_txt, formula_html, spg, pearson, crsystem)
+    SELECT * FROM UNNEST(
+        :elements::varchar[], :formulae_txt::varchar[], :formulae_html::varchar[],
+        :spgs::int[], :pearsons::varchar[], :crsystems::smallint[]
+    ) ON CONFLICT DO NOTHING;
+    """,
+    search_phases="""
+    SELECT phid, elements, formula_txt, formula_html, spg, pearson, crsystem FROM {PHASE_TABLE}
+    WHERE elements = :elements AND phid > :after ORDER BY phid LIMIT :limit;
+    """,
+    get_refined="""
+    SELECT hash, formula, payload, phase, fingerprint FROM {REFINED_TABLE}
+    WHERE hash = ANY(:hashes::char(40)[]) AND fingerprint IS NOT NULL;
+    """,
+    put_refined="""
+    INSERT INTO {REFINED_TABLE} (hash, formula, payload, phase, fingerprint)
+    SELECT * FROM UNNEST(
+        :hashes::char(40)[], :formulae::varchar[], :payloads::bytea[], :phases::jsonb[],
+        :fingerprints::char(40)[]
+    ) ON CONFLICT (hash) DO UPDATE SET fingerprint = EXCLUDED.fingerprint;
+    """,
+    search_item="""
+    SELECT item_id, metadata, content, type FROM {NODE_TABLE}
+    WHERE content_hash = md5(:content::varchar)::uuid AND content = :content::varchar LIMIT 1;
+    """,
+    drop_items="""
+    WITH links AS (
+        DELETE FROM {LINK_TABLE} WHERE source_id = ANY(:uuids::uuid[]) OR target_id = ANY(:uuids::uuid[])
+    )
+    DELETE FROM {NODE_TABLE} WHERE item_id = ANY(:uuids::uuid[]) RETURNING item_id;
+    """,
+)
+
+
 class Data_storage:
-    def __init__(self, user, password, database, host, port=5432):
+    _pool = None
+    _checked_out = False
+
+    def __init__(self, user, password, database, host, port=5432, cache=None, patterns=None):
+        """
+        Args:
+            cache: (object) Node_cache, shared between the connections
+            patterns: (object) Pattern_index, kept up to date with the stored patterns
+        """
         self.connection = pg8000.connect(
             user=user, password=password, database=database, host=host, port=int(port)
         )
         self.cursor = self.connection.cursor()
+        self.statements = {}
+        self.cache = cache
+        self.patterns = patterns
 
-    def put_item(self, metadata, content, type):
-        self.cursor.execute(
-            """
-        INSERT INTO {NODE_TABLE} (metadata, content, type) VALUES ('{metadata}', '{content}', {type}) RETURNING item_id;
-        """.format(
-                NODE_TABLE=NODE_TABLE,
-                metadata=json.dumps(metadata),
-                content=json.dumps(content) if isinstance(content, dict) else content,
-                type=type,
+    def _run(self, name, fields=NODE_FIELDS, **params):
+        """
+        Server-side prepared statements are parsed and planned
+        only once per connection (and per fields projection),
+        then just the parameters are bound;
+        NB pg8000 sends all the parameters in the text format,
+        so e.g. the bytes go as the hex-escaped bytea literals, twice their size
+        """
+        key = (name, fields)
+        statement = self.statements.get(key)
+        if not statement:
+            statement = self.statements[key] = self.connection.prepare(
+                STATEMENTS[name].format(
+                    NODE_TABLE=NODE_TABLE,
+                    LINK_TABLE=LINK_TABLE,
+                    PHASE_TABLE=PHASE_TABLE,
+                    REFINED_TABLE=REFINED_TABLE,
+                    FIELDS=", ".join(fields),
+                )
             )
+        return statement.run(**params)
+
+    @staticmethod
+    def _projection(fields):
+        """
+        Only the known columns are selected, always in the same order
+        """
+        return tuple(field for field in NODE_FIELDS if field in (fields or ())) or NODE_FIELDS
+
+    def _from_cache(self, uuid, fields):
+        if not self.cache:
+            return None
+
+        node = self.cache.get(uuid)
+        if node is None:
+            return None
+        # NB the metadata dict is mutable, so the caller gets its own copy
+        return dict(uuid=uuid, **{
+            field: deepcopy(node[field]) if field == "metadata" else node[field] for field in fields
+        })
+
+    def _to_cache(self, item, fields):
+        if not self.cache or fields != NODE_FIELDS or item["type"] not in IMMUTABLE_TYPES:
+            return
+
+        self.cache.put(
+            item["uuid"],
+            {field: item[field] for field in NODE_FIELDS},
+            size=len(item["content"] or "") + len(item["payload"] or b""),
         )
 
+    @staticmethod
+    def _dump(content):
+        if content is None:
+            return None
+        return json.dumps(content) if isinstance(content, (dict, list)) else str(content)
+
+    def put_item(self, metadata, content, type, payload=None, fingerprint=None):
+        """
+        Args:
+            payload: (bytes) binary content, if any, stored as bytea
+                (but sent hex-escaped, see _run)
+            fingerprint: (str) canonical structure fingerprint, if any
+        """
+        rows = self._run(
+            "put_item",
+            metadata=json.dumps(metadata),
+            content=self._dump(content),
+            type=type,
+            payload=payload,
+            fingerprint=fingerprint,
+        )
+        self.connection.commit()
+
+        uuid = str(rows[0][0])
+        if self.patterns and type == Data_type.pattern:
+            self.patterns.add([(uuid, payload)])
+        return uuid
+
+    def put_items(self, items):
+        """
+        Bulk insert within a single transaction;
+        the uuids are generated here to be returned in the input order
+
+        Args:
+            items: (list) of (metadata, content, type[, payload[, fingerprint]]) tuples
+
+        Returns:
+            uuids (list)
+        """
+        uuids = [str(uuid4()) for _ in items]
+
+        for start in range(0, len(items), BULK_CHUNK_SIZE):
+            chunk = items[start:start + BULK_CHUNK_SIZE]
+            self._run(
+                "put_items",
+                uuids=uuids[start:start + BULK_CHUNK_SIZE],
+                metadata=[json.dumps(item[0]) for item in chunk],
+                contents=[self._dump(item[1]) for item in chunk],
+                types=[item[2] for item in chunk],
+                payloads=[item[3] if len(item) > 3 else None for item in chunk],
+                fingerprints=[item[4] if len(item) > 4 else None for item in chunk],
+            )
+
         self.connection.commit()
-        return str(self.cursor.fetchone()[0])
+
+        if self.patterns:
+            self.patterns.add([
+                (uuid, item[3]) for uuid, item in zip(uuids, items)
+                if item[2] == Data_type.pattern and len(item) > 3
+            ])
+        return uuids
 
     def put_link(self, source_uuid, target_uuid):
         try:
-            self.cursor.execute(
-                """
-            INSERT INTO {db_table} (source_id, target_id) VALUES ('{source_uuid}', '{target_uuid}');
-            """.format(
-                    db_table=LINK_TABLE,
-                    source_uuid=source_uuid,
-                    target_uuid=target_uuid,
-                )
-            )
+            self._run("put_link", source_uuid=str(source_uuid), target_uuid=str(target_uuid))
         except pg8000.exceptions.Error:
+            self.connection.rollback()
             return False
 
         self.connection.commit()
         return True
 
-    def get_item(self, uuid, with_links=False):
-        self.cursor.execute(
-            "SELECT item_id, metadata, content, type FROM {NODE_TABLE} WHERE item_id = '{uuid}';".format(
-                NODE_TABLE=NODE_TABLE, uuid=uuid
-            )
-        )
-        row = self.cursor.fetchone()
-        if not row:
-            return False
+    def put_links(self, links):
+        """
+        Bulk insert within a single transaction, skipping the existing links
+
+        Args:
+            links: (list) of (source_uuid, target_uuid) tuples
+
+        Returns:
+            Whether each link was created (list of bools, in the input order);
+            if the batch fails, nothing is created, so all are False
+        """
+        links = [(str(source), str(target)) for source, target in links]
+        created = set()
+
+        try:
+            for start in range(0, len(links), BULK_CHUNK_SIZE):
+                chunk = links[start:start + BULK_CHUNK_SIZE]
+                for row in self._run(
+                    "put_links",
+                    source_uuids=[source for source, _ in chunk],
+                    target_uuids=[target for _, target in chunk],
+                ):
+                    created.add((str(row[0]), str(row[1])))
+
+        except pg8000.exceptions.Error:
+            self.connection.rollback()
+            return [False] * len(links)
+
+        self.connection.commit()
+
+        result = []
+        for link in links:
+            result.append(link in created)
+            created.discard(link)
+        return result
+
+    def get_item(self, uuid, with_links=False, fields=None):
+        """
+        Args:
+            fields: (list) node columns to fetch, e.g. to skip the heavy content
+
+        Returns:
+            Node (dict) *or* False
+        """
+        fields = self._projection(fields)
+        uuid = str(UUID(str(uuid)))
+
+        item = self._from_cache(uuid, fields)
+        if not item:
+            rows = self._run("get_item", fields=fields, uuid=uuid)
+            if not rows:
+                return False
+            item = dict(uuid=str(rows[0][0]), **dict(zip(fields, rows[0][1:])))
+            self._to_cache(item, fields)
 
         parents, children = [], []
         if with_links:
-            self.cursor.execute(
-                """
-            SELECT NULL, target_id FROM {LINK_TABLE} WHERE source_id = '{uuid}'
-            UNION ALL
-            SELECT source_id, NULL FROM {LINK_TABLE} WHERE target_id = '{uuid}';""".format(
-                    LINK_TABLE=LINK_TABLE, uuid=uuid
-                )
-            )
-            for link in self.cursor.fetchall():
+            for link in self._run("get_links", uuid=uuid):
                 children.append(str(link[1])) if link[1] else parents.append(str(link[0]))
 
-        return dict(
-            uuid=str(row[0]),
-            metadata=row[1],
-            content=row[2],
-            type=row[3],
-            parents=parents,
-            children=children,
-        )
+        return dict(**item, parents=parents, children=children)
 
-    def get_items(self, uuids, with_links=False):
-        placeholder = "item_id IN ({})".format(", ".join(["%s"] * len(uuids)))
+    def get_items(self, uuids, with_links=False, fields=None):
+        """
+        Args:
+            fields: (list) node columns to fetch, e.g. to skip the heavy content
+        """
+        fields = self._projection(fields)
+        uuids = [str(UUID(str(uuid))) for uuid in uuids]
 
-        sql_statement = "SELECT item_id, metadata, content, type FROM {NODE_TABLE} WHERE {placeholder};".format(
-            NODE_TABLE=NODE_TABLE, placeholder=placeholder
-        )
-        self.cursor.execute(sql_statement, uuids)
-
-        items = {}
-        for row in self.cursor.fetchall():
-            items[str(row[0])] = dict(
-                uuid=str(row[0]),
-                metadata=row[1],
-                content=row[2],
-                type=row[3],
-                parents=[],
-                children=[],
-            )
+        items, missing = {}, []
+        for uuid in uuids:
+            item = self._from_cache(uuid, fields)
+            if item:
+                items[uuid] = dict(**item, parents=[], children=[])
+            else:
+                missing.append(uuid)
+
+        for row in self._run("get_items", fields=fields, uuids=missing) if missing else []:
+            item = dict(uuid=str(row[0]), **dict(zip(fields, row[1:])))
+            self._to_cache(item, fields)
+            items[item["uuid"]] = dict(**item, parents=[], children=[])
 
         if with_links:
-            self.cursor.execute(
-                """WITH uuid_rows AS (
-            SELECT * from UNNEST(ARRAY['{placeholder}']::uuid[])
-            )
-            SELECT source_id, NULL, target_id FROM {LINK_TABLE} WHERE source_id IN (SELECT * FROM uuid_rows)
-            UNION ALL
-            SELECT target_id, source_id, NULL FROM {LINK_TABLE} WHERE target_id IN (SELECT * FROM uuid_rows);
-            """.format(
-                    LINK_TABLE=LINK_TABLE,
-                    placeholder="', '".join([str(uuid) for uuid in uuids]),
-                )
-            )
-            for row in self.cursor.fetchall():
+            for row in self._run("get_items_links", uuids=uuids):
                 items[str(row[0])]["children"].append(str(row[2])) if row[2] \
                     else items[str(row[0])]["parents"].append(str(row[1]))
 
@@ -133,49 +406,304 @@ class Data_storage:
     def get_targets(self, uuid):
         raise NotImplementedError
 
-    def get_sources(self, uuid):
-        self.cursor.execute(
-            """SELECT item_id, metadata, content, type
-        FROM {NODE_TABLE}
-        WHERE item_id IN (
-            SELECT source_id FROM {LINK_TABLE} WHERE target_id = '{uuid}'
-        );""".format(
-                NODE_TABLE=NODE_TABLE, LINK_TABLE=LINK_TABLE, uuid=uuid
-            )
+    def get_sources(self, uuid, fields=None):
+        fields = self._projection(fields)
+        return [
+            dict(uuid=str(row[0]), **dict(zip(fields, row[1:])))
+            for row in self._run("get_sources", fields=fields, uuid=str(uuid))
+        ]
+
+    def get_sources_many(self, uuids, fields=None):
+        """
+        Same as get_sources, but for many nodes in one query
+
+        Returns:
+            Mapping of each node uuid to its sources (dict of lists)
+        """
+        fields = self._projection(fields)
+        uuids = [str(uuid) for uuid in uuids]
+
+        sources = {uuid: [] for uuid in uuids}
+        for row in self._run("get_sources_many", fields=fields, uuids=uuids):
+            sources[str(row[0])].append(dict(uuid=str(row[1]), **dict(zip(fields, row[2:]))))
+
+        return sources
+
+    def get_lineage(self, uuids, direction="both", depth=MAX_LINEAGE_DEPTH, types=None):
+        """
+        Provenance subgraph in a single round trip;
+        the cycles are cut, as a walk never revisits a node of its own path;
+        NB a node reached by several paths (e.g. in a diamond) is walked along each of them,
+        up to the depth limit, and is only given once
+
+        Args:
+            uuids: (list) starting nodes
+            direction: (str) *ancestors*, *descendants*, or *both*
+            depth: (int) max number of hops
+            types: (list) Data_type values of the nodes to walk through
+
+        Returns:
+            dict of nodes (list of dicts, without content) and edges (list of pairs)
+        """
+        nodes, edges = [], []
+        for row in self._run(
+            "get_lineage",
+            uuids=[str(uuid) for uuid in uuids],
+            ancestors=direction in ("ancestors", "both"),
+            descendants=direction in ("descendants", "both"),
+            depth=min(int(depth), MAX_LINEAGE_DEPTH),
+            types=list(types or []),
+        ):
+            if row[0]:
+                nodes.append(dict(uuid=str(row[0]), metadata=row[1], type=row[2]))
+            else:
+                edges.append([str(row[3]), str(row[4])])
+
+        return dict(nodes=nodes, edges=edges)
+
+    def browse_items(self, type, after=None, limit=MAX_PAGE_SIZE):
+        """
+        Keyset-paginated node summaries of a type, in the order of creation
+
+        Args:
+            after: (tuple) created_at (str) and uuid (str) of the last node of the previous page
+
+        Returns:
+            Nodes (list of dicts, without content)
+        """
+        created_at, uuid = after or ("-infinity", "00000000-0000-0000-0000-000000000000")
+        rows = self._run(
+            "browse_items",
+            type=type,
+            created_at=created_at,
+            after=uuid,
+            limit=min(int(limit), MAX_PAGE_SIZE),
         )
+        self.connection.rollback()
         return [
-            dict(uuid=str(row[0]), metadata=row[1], content=row[2], type=row[3])
-            for row in self.cursor.fetchall()
+            dict(uuid=str(row[0]), metadata=row[1], type=row[2], created_at=row[3])
+            for row in rows
         ]
 
-    def search_item(self, content):
-        self.cursor.execute(
-            "SELECT item_id, metadata, content, type FROM {NODE_TABLE} WHERE content = '{content}';".format(
-                NODE_TABLE=NODE_TABLE, content=content
+    def iter_items(self, type, fields=None, batch_size=BULK_CHUNK_SIZE):
+        """
+        Walk over all the nodes of a type in batches,
+        e.g. for the maintenance jobs
+
+        Yields:
+            Node (dict)
+        """
+        fields = self._projection(fields)
+        after = "00000000-0000-0000-0000-000000000000"
+
+        while True:
+            rows = self._run("iter_items", fields=fields, type=type, after=after, limit=batch_size)
+            self.connection.rollback()
+            for row in rows:
+                yield dict(uuid=str(row[0]), **dict(zip(fields, row[1:])))
+
+            if len(rows) < batch_size:
+                break
+            after = str(rows[-1][0])
+
+    def update_payloads(self, payloads):
+        """
+        Replace the content of the nodes with the binary payloads in bulk
+
+        Args:
+            payloads: (list) of (uuid, payload) tuples
+        """
+        for start in range(0, len(payloads), BULK_CHUNK_SIZE):
+            chunk = payloads[start:start + BULK_CHUNK_SIZE]
+            self._run(
+                "update_payloads",
+                uuids=[str(uuid) for uuid, _ in chunk],
+                payloads=[payload for _, payload in chunk],
+            )
+
+        self.connection.commit()
+
+        if self.cache:
+            for uuid, _ in payloads:
+                self.cache.drop(str(UUID(str(uuid))))
+
+    def update_patterns(self, patterns):
+        """
+        Replace both the display content and the payload of the patterns in bulk
+
+        Args:
+            patterns: (list) of (uuid, content, payload) tuples
+        """
+        for start in range(0, len(patterns), BULK_CHUNK_SIZE):
+            chunk = patterns[start:start + BULK_CHUNK_SIZE]
+            self._run(
+                "update_patterns",
+                uuids=[str(uuid) for uuid, _, _ in chunk],
+                contents=[self._dump(content) for _, content, _ in chunk],
+                payloads=[payload for _, _, payload in chunk],
+            )
+
+        self.connection.commit()
+
+        if self.cache:
+            for uuid, _, _ in patterns:
+                self.cache.drop(str(UUID(str(uuid))))
+        if self.patterns:
+            self.patterns.add([(uuid, payload) for uuid, _, payload in patterns])
+
+    def update_fingerprints(self, fingerprints):
+        """
+        Args:
+            fingerprints: (list) of (uuid, fingerprint) tuples
+        """
+        for start in range(0, len(fingerprints), BULK_CHUNK_SIZE):
+            chunk = fingerprints[start:start + BULK_CHUNK_SIZE]
+            self._run(
+                "update_fingerprints",
+                uuids=[str(uuid) for uuid, _ in chunk],
+                fingerprints=[fingerprint for _, fingerprint in chunk],
+            )
+
+        self.connection.commit()
+
+    def search_fingerprints(self, fingerprints, type=Data_type.structure):
+        """
+        Find the earliest stored nodes with the given canonical fingerprints
+
+        Returns:
+            dict of fingerprint: dict(uuid, metadata, type)
+        """
+        rows = self._run("search_fingerprints", fingerprints=list(fingerprints), type=type)
+        self.connection.rollback()
+        return {row[0]: dict(uuid=str(row[1]), metadata=row[2], type=row[3]) for row in rows}
+
+    def put_phases(self, phases):
+        """
+        Maintain the distinct phases, skipping the known ones
+
+        Args:
+            phases: (list) of dicts, see i_structures.struct_utils.get_phase
+        """
+        for start in range(0, len(phases), BULK_CHUNK_SIZE):
+            chunk = phases[start:start + BULK_CHUNK_SIZE]
+            self._run(
+                "put_phases",
+                elements=[phase["elements"] for phase in chunk],
+                formulae_txt=[phase["formula_txt"] for phase in chunk],
+                formulae_html=[phase["formula_html"] for phase in chunk],
+                spgs=[phase["spg"] for phase in chunk],
+                pearsons=[phase["pearson"] for phase in chunk],
+                crsystems=[phase["crsystem"] for phase in chunk],
             )
+
+        self.connection.commit()
+
+    def search_phases(self, elements, after=0, limit=MAX_PAGE_SIZE):
+        """
+        Keyset-paginated phases of a chemical system
+
+        Args:
+            elements: (str) sorted dash-separated elements, e.g. O-Sr-Ti
+            after: (int) the last phid of the previous page
+        """
+        rows = self._run(
+            "search_phases", elements=elements, after=int(after), limit=min(int(limit), MAX_PAGE_SIZE)
         )
-        row = self.cursor.fetchone()
-        if not row:
+        self.connection.rollback()
+        return [
+            dict(
+                phid=row[0],
+                elements=row[1],
+                formula_txt=row[2],
+                formula_html=row[3],
+                spg=row[4],
+                pearson=row[5],
+                crsystem=row[6],
+            )
+            for row in rows
+        ]
+
+    def get_refined(self, hashes):
+        """
+        Memoized structure refinement results,
+        see i_structures.struct_utils.structure_hash
+
+        Returns:
+            dict of hash: dict(formula, payload, phase, fingerprint)
+        """
+        rows = self._run("get_refined", hashes=list(hashes))
+        self.connection.rollback()
+        return {
+            row[0]: dict(formula=row[1], payload=bytes(row[2]), phase=row[3], fingerprint=row[4])
+            for row in rows
+        }
+
+    def put_refined(self, results):
+        """
+        Args:
+            results: (dict) of hash: dict(formula, payload, phase, fingerprint)
+        """
+        hashes = list(results)
+        for start in range(0, len(hashes), BULK_CHUNK_SIZE):
+            chunk = [(key, results[key]) for key in hashes[start:start + BULK_CHUNK_SIZE]]
+            self._run(
+                "put_refined",
+                hashes=[key for key, _ in chunk],
+                formulae=[result["formula"] for _, result in chunk],
+                payloads=[result["payload"] for _, result in chunk],
+                phases=[json.dumps(result["phase"]) if result["phase"] else None for _, result in chunk],
+                fingerprints=[result["fingerprint"] for _, result in chunk],
+            )
+
+        self.connection.commit()
+
+    def search_item(self, content):
+        """
+        NB the lookup goes via the indexed content hash,
+        e.g. for the scheduler task ids of the calculations
+        """
+        rows = self._run("search_item", content=str(content))
+        if not rows:
             return False
+        row = rows[0]
 
         return dict(uuid=str(row[0]), metadata=row[1], content=row[2], type=row[3])
 
     def drop_item(self, uuid):
-        if self.get_item(uuid):
-            self.cursor.execute(
-                "DELETE FROM {LINK_TABLE} WHERE source_id = '{uuid}' OR target_id = '{uuid}';".format(
-                    LINK_TABLE=LINK_TABLE, uuid=uuid
-                )
-            )
-            self.cursor.execute(
-                "DELETE FROM {NODE_TABLE} WHERE item_id = '{uuid}';".format(
-                    NODE_TABLE=NODE_TABLE, uuid=uuid
-                )
-            )
-            self.connection.commit()
-            return True
+        return bool(self.drop_items([uuid]))
 
-        return False
+    def drop_items(self, uuids):
+        """
+        Remove the nodes together with their links in a single statement
+
+        Returns:
+            uuids of the removed nodes (list)
+        """
+        uuids = [str(UUID(str(uuid))) for uuid in uuids]
+        removed = [str(row[0]) for row in self._run("drop_items", uuids=uuids)]
+        self.connection.commit()
+
+        if self.cache:
+            for uuid in uuids:
+                self.cache.drop(uuid)
+        if self.patterns:
+            self.patterns.drop(removed)
+        return removed
+
+    def ping(self):
+        try:
+            self.cursor.execute("SELECT 1;")
+            self.cursor.fetchall()
+            self.connection.rollback()
+        except (pg8000.exceptions.Error, OSError, AttributeError):
+            return False
+        return True
 
     def close(self):
-        self.connection.close()
+        """
+        NB a pooled connection is not closed but returned to its pool
+        """
+        if self._pool:
+            self._pool.checkin(self)
+        else:
+            self.connection.close()
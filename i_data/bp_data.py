@@ -1,133 +1,348 @@
 # from pprint import pprint
 import json
+import base64
+from datetime import datetime
 from unidecode import unidecode
 from io import StringIO
 
-from flask import Blueprint, current_app, request, abort, Response
+from flask import Blueprint, current_app, request, Response
 from ase import io as ase_io
+from ase.data import chemical_symbols
 
-from i_data import Data_type
+from i_data import Data_type, MAX_LINEAGE_DEPTH, MAX_PAGE_SIZE
 from i_structures import html_formula
 from i_structures.struct_utils import (
     detect_format,
-    poscar_to_ase,
-    optimade_to_ase,
-    refine,
-    get_formula,
-    ase_serialize,
-    ase_unserialize,
+    CRYSTAL_SYSTEMS,
+    structure_hash,
+)
+from i_structures.cif_utils import read_cif, cif_values_to_ase
+from i_structures.pipeline import parse_content, process_structure, DISORDER_ERROR
+from i_calculations.xrpd import (
+    get_pattern,
+    get_pattern_name,
+    decimate_pattern,
+    is_packed_pattern,
+    pattern_size,
+    pattern_to_list,
+    pattern_unserialize,
+    parse_pattern_lines,
+    split_pattern_lines,
+    project_pattern,
+)
+from i_data.similarity import METRICS
+
+from utils import (
+    get_data_storage,
+    get_ase,
+    fmt_msg,
+    key_auth,
+    is_plain_text,
+    is_valid_uuid,
+    pool,
+    node_cache,
+    refine_cache,
+    REFINE_CACHE_PERSIST,
+    workers,
+    pattern_index,
 )
-from i_structures.cif_utils import cif_to_ase
-from i_calculations.xrpd import get_pattern, get_pattern_name
-
-from utils import get_data_storage, fmt_msg, key_auth, is_plain_text, is_valid_uuid
 
 
 bp_data = Blueprint("data", __name__, url_prefix="/data")
 
 
-@bp_data.route("/create", methods=["POST"])
-@key_auth
-def create():
+MAX_BATCH_ITEMS = 1000
+MAX_CONTENT_LEN = 300000
+MAX_CIF_COLLECTION_LEN = MAX_BATCH_ITEMS * MAX_CONTENT_LEN // 10
+MAX_BATCH_LEN = MAX_CIF_COLLECTION_LEN  # all the contents together
+MAX_REQUEST_LEN = 3 * MAX_BATCH_LEN  # NB the form encoding may triple the size
+MAX_SIMILAR_ITEMS = 100
+
+
+def ingest(content, fmt=None, name=None):
     """
-    @api {post} /data/create create
-    @apiGroup Datasources
-    @apiDescription Datasource recognition and saving logics
+    Datasource recognition logics: detect_format -> parse -> refine;
+    the structures are processed by the worker processes,
+    CIF may contain many data blocks, each giving a separate node
 
-    @apiParam {String} content Crystal structure or pattern
-    @apiParam {String} [fmt] Format (only used xy for patterns)
-    @apiParam {String} [name] Title for content (only used for patterns)
+    Returns:
+        Nodes (list) to be saved, or per-block errors as dict(error=...) *or* None
+        None *or* error (str)
     """
-    content = request.values.get("content")
     if not content:
-        return fmt_msg("Empty request")
+        return None, "Empty request"
 
-    if not 0 < len(content) < 300000:
-        return fmt_msg("Request size is invalid")
+    if not 0 < len(content) < MAX_CIF_COLLECTION_LEN:
+        return None, "Request size is invalid"
 
     if not is_plain_text(content):
-        # return fmt_msg('Request contains unsupported (non-latin) characters')
+        # return None, 'Request contains unsupported (non-latin) characters'
         content = unidecode(content)
 
-    fmt = request.values.get("fmt") or detect_format(content)
-    ase_obj, raw_obj, error = None, None, None
+    fmt = fmt or detect_format(content)
+    if fmt != "cif" and len(content) >= MAX_CONTENT_LEN:
+        return None, "Request size is invalid"
+
+    if fmt in ("cif", "poscar", "optimade"):
+        if fmt == "cif":
+            blocks, error = workers.run(read_cif, content)
+            if error:
+                return None, error
 
-    if fmt == "cif":
-        ase_obj, error = cif_to_ase(content)
+            if len(blocks) > MAX_BATCH_ITEMS:
+                return None, "Too many data blocks in CIF"
 
-    elif fmt == "poscar":
-        ase_obj, error = poscar_to_ase(content)
+            parsed = run_workers(cif_values_to_ase, [block["values"] for block in blocks])
+        else:
+            parsed = [workers.run(parse_content, content, fmt)]
 
-    elif fmt == "optimade":
-        ase_obj, error = optimade_to_ase(content)
+        results = refine_structures(parsed)
+        if len(results) == 1 and results[0][1]:
+            return None, results[0][1]
+
+        return [
+            structure_node(result) if not error else dict(error=error)
+            for result, error in results
+        ], None
 
     elif fmt == "xy":
         raw_obj = get_pattern(content)
-
         if not raw_obj:
-            error = "Not a valid pattern provided"
+            return None, "Not a valid pattern provided"
 
     else:
-        return fmt_msg("Provided data format unsuitable or not recognized")
+        return None, "Provided data format unsuitable or not recognized"
+
+    name = name or get_pattern_name()
+    maxnamelen = 24
+    if len(name) > maxnamelen:
+        name = name[:maxnamelen]
+
+    return [
+        dict(
+            metadata=dict(name=name),
+            content=raw_obj["content"],
+            type=raw_obj["type"],
+            payload=raw_obj["payload"],
+            phase=None,
+            fingerprint=None,
+        )
+    ], None
 
-    if error:
-        return fmt_msg(error)
 
-    if ase_obj:
-        if "disordered" in ase_obj.info:
-            return fmt_msg("Structural disorder is currently not supported")
+def run_workers(func, args):
+    """
+    A single task is rejected if the workers are busy,
+    whereas a batch waits for them
+    """
+    if len(args) == 1:
+        return [workers.run(func, args[0])]
+    return workers.map(func, args)
+
+
+def refine_structures(parsed):
+    """
+    Refinement memoized by the canonical structure hash, first in memory,
+    then optionally in the database; only the unknown structures go to the workers
+
+    Args:
+        parsed: (list) of (ASE atoms, error) tuples
 
-        ase_obj, error = refine(ase_obj, conventional_cell=True)
+    Returns:
+        (list) of (dict of formula, payload, and phase *or* None, None *or* error) tuples
+    """
+    results = list(parsed)
+    keys = {}  # hash -> indices of the same structures
+    for n, (ase_obj, error) in enumerate(parsed):
         if error:
-            return fmt_msg(error)
+            continue
+        if "disordered" in ase_obj.info:
+            results[n] = (None, DISORDER_ERROR)
+        else:
+            keys.setdefault(structure_hash(ase_obj, conventional_cell=True), []).append(n)
+
+    found = {}
+    for key in keys:
+        result = refine_cache.get(key, kind="refined")
+        if result is not None:
+            found[key] = result
+
+    if REFINE_CACHE_PERSIST and len(found) < len(keys):
+        stored = get_data_storage().get_refined([key for key in keys if key not in found])
+        refine_cache.count("stored_hits", len(stored))
+        for key, result in stored.items():
+            refine_cache.put(key, result, size=len(result["payload"]), kind="refined")
+        found.update(stored)
+
+    missing = [key for key in keys if key not in found]
+    refined = {}
+    for key, (result, error) in zip(
+        missing, run_workers(process_structure, [parsed[keys[key][0]][0] for key in missing])
+    ):
+        if error:
+            for n in keys[key]:
+                results[n] = (None, error)
+        else:
+            refined[key] = result
+            refine_cache.put(key, result, size=len(result["payload"]), kind="refined")
+
+    if REFINE_CACHE_PERSIST and refined:
+        get_data_storage().put_refined(refined)
+
+    for key, result in list(found.items()) + list(refined.items()):
+        for n in keys[key]:
+            results[n] = (result, None)
+
+    return results
+
+
+def structure_node(result):
+    return dict(
+        metadata=dict(name=html_formula(result["formula"])),
+        content=None,
+        type=Data_type.structure,
+        payload=result["payload"],
+        phase=result["phase"],
+        fingerprint=result["fingerprint"],
+    )
 
-        formula = get_formula(ase_obj)
-        content = ase_serialize(ase_obj)
 
-        db = get_data_storage()
-        new_uuid = db.put_item(
-            dict(name=html_formula(formula)), content, Data_type.structure
-        )
-        db.close()
+def save_nodes(nodes, dedup=True):
+    """
+    Store the nodes (skipping errors) with a single bulk insert,
+    and assign their uuids in place; unless disabled, the structures
+    already stored (or repeated in the nodes) are not stored again,
+    but the existing nodes are given instead, marked as duplicate
+    """
+    nodes = [node for node in nodes if "error" not in node]
+    if not nodes:
+        return
 
-        return Response(
-            json.dumps(
-                dict(
-                    uuid=new_uuid,
-                    type=Data_type.structure,
-                    name=html_formula(formula),
-                ),
-                indent=4,
-            ),
-            content_type="application/json",
-            status=200,
+    db = get_data_storage()
+    existing, new_nodes, repeated = {}, [], []
+
+    if dedup:
+        fingerprints = set(node["fingerprint"] for node in nodes if node["fingerprint"])
+        if fingerprints:
+            existing = db.search_fingerprints(fingerprints)
+
+    for node in nodes:
+        if not dedup or not node["fingerprint"]:
+            new_nodes.append(node)
+        elif node["fingerprint"] in existing:
+            repeated.append(node)
+        else:
+            existing[node["fingerprint"]] = node
+            new_nodes.append(node)
+
+    if new_nodes:
+        new_uuids = db.put_items(
+            [
+                (node["metadata"], node["content"], node["type"], node["payload"], node["fingerprint"])
+                for node in new_nodes
+            ]
         )
+        for node, new_uuid in zip(new_nodes, new_uuids):
+            node["uuid"] = new_uuid
 
-    elif raw_obj:
-        name = request.values.get("name") or get_pattern_name()
-        maxnamelen = 24
-        if len(name) > maxnamelen:
-            name = name[:maxnamelen]
+    for node in repeated:
+        original = existing[node["fingerprint"]]
+        node.update(uuid=original["uuid"], metadata=original["metadata"], duplicate=True)
 
-        db = get_data_storage()
-        new_uuid = db.put_item(dict(name=name), raw_obj["content"], raw_obj["type"])
-        db.close()
+    phases = [node["phase"] for node in new_nodes if node["phase"]]
+    if phases:
+        db.put_phases(phases)
 
-        return Response(
-            json.dumps(
-                dict(
-                    uuid=new_uuid,
-                    type=raw_obj["type"],
-                    name=name,
-                ),
-                indent=4,
-            ),
-            content_type="application/json",
-            status=200,
-        )
 
-    else:
-        abort(400)
+def fmt_node(node):
+    if "error" in node:
+        return node
+
+    result = dict(uuid=node["uuid"], type=node["type"], name=node["metadata"]["name"])
+    if node.get("duplicate"):
+        result["duplicate"] = True
+    return result
+
+
+@bp_data.route("/create", methods=["POST"])
+@key_auth
+def create():
+    """
+    @api {post} /data/create create
+    @apiGroup Datasources
+    @apiDescription Datasource recognition and saving logics;
+    for CIF with many data blocks, the list of results (or errors)
+    is given, following the order of the blocks; a structure already
+    stored is given back instead of saving it again, marked as duplicate
+
+    @apiParam {String} content Crystal structure(s) or pattern
+    @apiParam {String} [fmt] Format (only used xy for patterns)
+    @apiParam {String} [name] Title for content (only used for patterns)
+    @apiParam {Boolean/String} [dedup] Set to false to always save a new structure
+    """
+    nodes, error = ingest(
+        request.values.get("content"),
+        fmt=request.values.get("fmt"),
+        name=request.values.get("name"),
+    )
+    if error:
+        return fmt_msg(error, getattr(error, "status", 400))
+
+    save_nodes(nodes, dedup=request.values.get("dedup") != "false")
+
+    return Response(
+        json.dumps(
+            fmt_node(nodes[0]) if len(nodes) == 1 else [fmt_node(node) for node in nodes],
+            indent=4,
+        ),
+        content_type="application/json",
+        status=200,
+    )
+
+
+@bp_data.route("/create_batch", methods=["POST"])
+@key_auth
+def create_batch():
+    """
+    @api {post} /data/create_batch create_batch
+    @apiGroup Datasources
+    @apiDescription Many datasources recognition and saving at once,
+    the results (or errors) follow the order of the contents given;
+    for CIF with many data blocks, the result is a list
+
+    @apiParam {String[]} content Crystal structures or patterns
+    @apiParam {String} [fmt] Format (only used xy for patterns)
+    @apiParam {Boolean/String} [dedup] Set to false to always save new structures
+    """
+    contents = request.values.getlist("content")
+    if not contents:
+        return fmt_msg("Empty request")
+
+    if len(contents) > MAX_BATCH_ITEMS:
+        return fmt_msg("Too many items requested")
+
+    if sum(len(content) for content in contents) >= MAX_BATCH_LEN:
+        return fmt_msg("Request size is invalid")
+
+    fmt = request.values.get("fmt")
+    results = []
+
+    for content in contents:
+        nodes, error = ingest(content, fmt=fmt)
+        results.append([dict(error=error)] if error else nodes)
+
+    save_nodes(
+        [node for nodes in results for node in nodes],
+        dedup=request.values.get("dedup") != "false",
+    )
+
+    results = [
+        fmt_node(nodes[0]) if len(nodes) == 1 else [fmt_node(node) for node in nodes]
+        for nodes in results
+    ]
+    return Response(
+        json.dumps(results, indent=4), content_type="application/json", status=200
+    )
 
 
 @bp_data.route("/listing", methods=["POST"])
@@ -154,7 +369,9 @@ def listing():
             if not is_valid_uuid(uuid):
                 return fmt_msg("Invalid request")
 
-        items = db.get_items(list(unique_uuids), with_links=True)
+        items = db.get_items(
+            list(unique_uuids), with_links=True, fields=("metadata", "type")
+        )
 
         # found_uuids = set( [item['uuid'] for item in items] )
         # if found_uuids != unique_uuids:
@@ -165,14 +382,12 @@ def listing():
         if not is_valid_uuid(uuid):
             return fmt_msg("Invalid request")
 
-        item = db.get_item(uuid, with_links=True)
+        item = db.get_item(uuid, with_links=True, fields=("metadata", "type"))
         items = [item] if item else []
 
     if not items:
         return fmt_msg("No such content", 204)
 
-    db.close()
-
     items_mapping = {
         item["uuid"]: dict(
             uuid=item["uuid"],
@@ -193,6 +408,179 @@ def listing():
     )
 
 
+@bp_data.route("/lineage", methods=["POST"])
+@key_auth
+def lineage():
+    """
+    @api {post} /data/lineage lineage
+    @apiGroup Datasources
+    @apiDescription Datasource provenance graph, i.e. all the ancestors and/or descendants
+
+    @apiParam {String/String[]} uuid What to consider
+    @apiParam {String} [direction] Either ancestors, descendants, or both (default)
+    @apiParam {Number} [depth] Max number of hops
+    @apiParam {Number/Number[]} [type] Walk only through the datasources of these types
+    """
+    uuid = request.values.get("uuid")
+    if not uuid:
+        return fmt_msg("Empty request")
+
+    uuids = list(dict.fromkeys(uuid.split(":")))
+    for uuid in uuids:
+        if not is_valid_uuid(uuid):
+            return fmt_msg("Invalid request")
+
+    direction = request.values.get("direction", "both")
+    if direction not in ("ancestors", "descendants", "both"):
+        return fmt_msg("Invalid request")
+
+    try:
+        depth = int(request.values.get("depth", MAX_LINEAGE_DEPTH))
+        types = [int(item) for item in request.values.get("type", "").split(":") if item]
+    except ValueError:
+        return fmt_msg("Invalid request")
+
+    if depth < 0:
+        return fmt_msg("Invalid request")
+
+    db = get_data_storage()
+    graph = db.get_lineage(uuids, direction=direction, depth=depth, types=types)
+
+    if not graph["nodes"]:
+        return fmt_msg("No such content", 204)
+
+    graph["nodes"] = [
+        dict(uuid=node["uuid"], name=node["metadata"]["name"], type=node["type"])
+        for node in graph["nodes"]
+    ]
+    return Response(
+        json.dumps(graph, indent=4), content_type="application/json", status=200
+    )
+
+
+@bp_data.route("/phases", methods=["POST"])
+@key_auth
+def phases():
+    """
+    @api {post} /data/phases phases
+    @apiGroup Datasources
+    @apiDescription Distinct phases of a chemical system, paginated
+    with the cursor given in the previous page
+
+    @apiParam {String} elements Chemical system, e.g. Sr-Ti-O
+    @apiParam {Number} [after] Cursor of the next page
+    @apiParam {Number} [limit] Page size
+    """
+    elements = request.values.get("elements")
+    if not elements:
+        return fmt_msg("Empty request")
+
+    elements = sorted(set(element.strip() for element in elements.split("-")))
+    if not all(element in chemical_symbols for element in elements):
+        return fmt_msg("Invalid request")
+
+    try:
+        after = int(request.values.get("after", 0))
+        limit = int(request.values.get("limit", MAX_PAGE_SIZE))
+    except ValueError:
+        return fmt_msg("Invalid request")
+
+    if after < 0 or limit < 1:
+        return fmt_msg("Invalid request")
+
+    db = get_data_storage()
+    found = db.search_phases("-".join(elements), after=after, limit=limit)
+
+    for phase in found:
+        phase["crsystem"] = CRYSTAL_SYSTEMS[phase["crsystem"] - 1]
+
+    return Response(
+        json.dumps(
+            dict(
+                phases=found,
+                next=found[-1]["phid"] if len(found) == min(limit, MAX_PAGE_SIZE) else None,
+            ),
+            indent=4,
+        ),
+        content_type="application/json",
+        status=200,
+    )
+
+
+def encode_cursor(item):
+    return base64.urlsafe_b64encode(
+        ("%s|%s" % (item["created_at"].isoformat(), item["uuid"])).encode("ascii")
+    ).decode("ascii")
+
+
+def decode_cursor(token):
+    """
+    Returns:
+        created_at (str) and uuid (str) *or* None
+    """
+    try:
+        created_at, uuid = base64.urlsafe_b64decode(token.encode("ascii")).decode("ascii").split("|")
+        datetime.fromisoformat(created_at)
+    except ValueError:
+        return None
+
+    if not is_valid_uuid(uuid):
+        return None
+    return created_at, uuid
+
+
+@bp_data.route("/browse", methods=["POST"])
+@key_auth
+def browse():
+    """
+    @api {post} /data/browse browse
+    @apiGroup Datasources
+    @apiDescription Datasources of a type in the order of creation, paginated
+    with the cursor given in the previous page
+
+    @apiParam {Number} type Data type
+    @apiParam {String} [after] Cursor of the next page
+    @apiParam {Number} [limit] Page size
+    """
+    try:
+        data_type = int(request.values.get("type"))
+        limit = int(request.values.get("limit", MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return fmt_msg("Invalid request")
+
+    if limit < 1:
+        return fmt_msg("Invalid request")
+
+    after = request.values.get("after")
+    if after:
+        after = decode_cursor(after)
+        if not after:
+            return fmt_msg("Invalid request")
+
+    db = get_data_storage()
+    items = db.browse_items(data_type, after=after, limit=limit)
+
+    return Response(
+        json.dumps(
+            dict(
+                items=[
+                    dict(
+                        uuid=item["uuid"],
+                        name=item["metadata"]["name"],
+                        type=item["type"],
+                        created_at=item["created_at"].isoformat(),
+                    )
+                    for item in items
+                ],
+                next=encode_cursor(items[-1]) if len(items) == min(limit, MAX_PAGE_SIZE) else None,
+            ),
+            indent=4,
+        ),
+        content_type="application/json",
+        status=200,
+    )
+
+
 @bp_data.route("/delete", methods=["POST"])
 @key_auth
 def delete():
@@ -201,18 +589,35 @@ def delete():
     @apiGroup Datasources
     @apiDescription Datasource removal
 
-    @apiParam {String} uuid What to consider
+    @apiParam {String/String[]} uuid What to consider
     """
     uuid = request.values.get("uuid")
-    if not uuid or not is_valid_uuid(uuid):
+    if not uuid:
         return fmt_msg("Empty or invalid request")
 
     db = get_data_storage()
-    result = db.drop_item(uuid)
-    db.close()
 
-    if result:
-        return Response("{}", content_type="application/json", status=200)
+    if ":" in uuid:
+        uuids = list(dict.fromkeys(uuid.split(":")))
+        for uuid in uuids:
+            if not is_valid_uuid(uuid):
+                return fmt_msg("Empty or invalid request")
+
+        removed = db.drop_items(uuids)
+        if removed:
+            return Response(
+                json.dumps(dict(deleted=removed), indent=4),
+                content_type="application/json",
+                status=200,
+            )
+
+    else:
+        if not is_valid_uuid(uuid):
+            return fmt_msg("Empty or invalid request")
+
+        if db.drop_item(uuid):
+            return Response("{}", content_type="application/json", status=200)
+
     return fmt_msg("No such content", 204)
 
 
@@ -222,17 +627,30 @@ def examine():
     """
     @api {post} /data/examine examine
     @apiGroup Datasources
-    @apiDescription Datasource display
+    @apiDescription Datasource display;
+    the large patterns are given decimated, unless full resolution is requested;
+    only a 2theta window of a pattern can be requested, e.g. for zooming
 
     @apiParam {String} uuid What to consider
+    @apiParam {Boolean/String} [full] Set to true for the full-resolution pattern
+    @apiParam {Number} [xmin] Pattern window start, 2theta
+    @apiParam {Number} [xmax] Pattern window end, 2theta
     """
     uuid = request.values.get("uuid")
     if not uuid or not is_valid_uuid(uuid):
         return fmt_msg("Empty or invalid request", 400)
 
+    full = request.values.get("full") == "true"
+    try:
+        xmin, xmax = (
+            float(request.values[key]) if request.values.get(key) else None
+            for key in ("xmin", "xmax")
+        )
+    except ValueError:
+        return fmt_msg("Invalid pattern window")
+
     db = get_data_storage()
     item = db.get_item(uuid)
-    db.close()
 
     if not item:
         return fmt_msg("Sorry these data cannot be shown")
@@ -245,12 +663,23 @@ def examine():
         )  # FIXME "default engine"
 
         try:
-            output["content"] = json.loads(item["content"])
+            if not is_packed_pattern(item["payload"]):
+                output["content"] = json.loads(item["content"])
+
+            elif full or xmin is not None or xmax is not None:
+                x, y = pattern_unserialize(item["payload"], xmin, xmax)
+                dec_x, dec_y = (x, y) if full else decimate_pattern(x, y)
+                output["content"] = pattern_to_list(dec_x, dec_y)
+                output["decimated"] = len(dec_x) < len(x)
+
+            else:
+                output["content"] = json.loads(item["content"])
+                output["decimated"] = len(output["content"]) < pattern_size(item["payload"])
         except Exception:
             return fmt_msg("Sorry these data are erroneous and cannot be shown")
 
     elif item["type"] == Data_type.structure:
-        ase_obj = ase_unserialize(item["content"])
+        ase_obj = get_ase(item)
 
         if len(ase_obj) < 10:
             orig_cell = ase_obj.cell[:]
@@ -268,3 +697,107 @@ def examine():
     return Response(
         json.dumps(output, indent=4), content_type="application/json", status=200
     )
+
+
+@bp_data.route("/similar", methods=["POST"])
+@key_auth
+def similar():
+    """
+    @api {post} /data/similar similar
+    @apiGroup Datasources
+    @apiDescription The stored patterns most similar to the given one,
+    either stored or not, the most similar first
+
+    @apiParam {String} [uuid] Stored pattern to consider
+    @apiParam {String} [content] Pattern to consider, if no uuid is given
+    @apiParam {Number} [limit] How many patterns to give, up to 100
+    @apiParam {String} [metric] Either cosine (default) or pearson
+    """
+    if not pattern_index:
+        return fmt_msg("Similarity search is not configured", 503)
+
+    metric = request.values.get("metric", "cosine")
+    try:
+        limit = int(request.values.get("limit", 10))
+    except ValueError:
+        return fmt_msg("Invalid request")
+
+    if metric not in METRICS or not 0 < limit <= MAX_SIMILAR_ITEMS:
+        return fmt_msg("Invalid request")
+
+    db = get_data_storage()
+    uuid, content = request.values.get("uuid"), request.values.get("content")
+
+    if uuid:
+        if not is_valid_uuid(uuid):
+            return fmt_msg("Invalid request")
+
+        vector = pattern_index.get(uuid)
+        if vector is None:
+            item = db.get_item(uuid, fields=("type", "payload"))
+            if not item or item["type"] != Data_type.pattern:
+                return fmt_msg("No such pattern", 204)
+            try:
+                vector = project_pattern(*pattern_unserialize(item["payload"]))
+            except (TypeError, ValueError):
+                return fmt_msg("Sorry these data are erroneous and cannot be compared")
+
+    elif content and len(content) < MAX_CONTENT_LEN:
+        columns = parse_pattern_lines(split_pattern_lines(content))
+        if columns is None:
+            return fmt_msg("Not a valid pattern provided")
+        vector = project_pattern(*columns)
+
+    else:
+        return fmt_msg("Empty or invalid request")
+
+    if vector is None:
+        return fmt_msg("Pattern is outside the 2theta range compared")
+
+    found = pattern_index.search(vector, limit=limit, metric=metric, exclude=[uuid] if uuid else [])
+    items = {
+        item["uuid"]: item
+        for item in db.get_items([uuid for uuid, _ in found], fields=("metadata", "type"))
+    } if found else {}
+
+    return Response(
+        json.dumps(
+            [
+                dict(
+                    uuid=uuid,
+                    name=items[uuid]["metadata"]["name"],
+                    type=items[uuid]["type"],
+                    similarity=similarity,
+                )
+                for uuid, similarity in found
+                if uuid in items
+            ],
+            indent=4,
+        ),
+        content_type="application/json",
+        status=200,
+    )
+
+
+@bp_data.route("/stats", methods=["GET"])
+@key_auth
+def stats():
+    """
+    @api {get} /data/stats stats
+    @apiGroup Datasources
+    @apiDescription Diagnostics, e.g. connection pool and worker processes usage
+    """
+    return Response(
+        json.dumps(
+            dict(
+                pool=pool.stats(),
+                cache=node_cache.stats(),
+                refine_cache=refine_cache.stats(),
+                workers=workers.stats(),
+                patterns=pattern_index.stats() if pattern_index else None,
+            ),
+            indent=4,
+        ),
+        content_type="application/json",
+        status=200,
+    )
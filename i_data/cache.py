@@ -0,0 +1,239 @@
+"""
+A read-through LRU cache for the immutable nodes,
+as well as for the objects decoded from their content;
+bounded by the approximate size in bytes;
+the node rows can be optionally kept in a file shared by all the processes,
+whereas the decoded objects are always kept in-process
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+ENTRY_OVERHEAD = 512
+SHARED_TIMEOUT = 5  # seconds to wait for the writer of another process
+
+
+class Node_cache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, path=None):
+        """
+        Args:
+            max_bytes: (int) bound of each of the in-process and the shared parts
+            path: (str) file shared by all the processes, if any
+        """
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+
+        self._entries = OrderedDict()  # (uuid, kind) -> (value, size)
+        self._kinds = {}  # uuid -> set of kinds
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, misses=0, evictions=0)
+        self._shared = Shared_store(path, self.max_bytes) if path else None
+
+    def get(self, uuid, kind="node"):
+        if self._shared:
+            value = self._shared.get(uuid, kind)
+            self.count("misses" if value is None else "hits")
+            return value
+
+        with self._lock:
+            entry = self._entries.get((uuid, kind))
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end((uuid, kind))
+            self._counters["hits"] += 1
+            return entry[0]
+
+    def put(self, uuid, value, size=0, kind="node"):
+        """
+        Args:
+            value: (dict) NB if shared, of the JSON types, except the payload (bytes)
+        """
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        if self._shared:
+            self.count("evictions", self._shared.put(uuid, kind, value, size))
+            return
+
+        self._put_local(uuid, value, size, kind)
+
+    def get_decoded(self, uuid, decoder, data):
+        """
+        Memoize the object decoded from the node content;
+        NB the object is shared, so a caller should copy it before any change
+        """
+        kind = decoder.__name__
+        with self._lock:
+            entry = self._entries.get((uuid, kind))
+            if entry is not None:
+                self._entries.move_to_end((uuid, kind))
+                return entry[0]
+
+        value = decoder(data)
+        size = len(data) * 4 + ENTRY_OVERHEAD
+        if size <= self.max_bytes:
+            self._put_local(uuid, value, size, kind)
+        return value
+
+    def count(self, key, value=1):
+        """
+        Extra counters, e.g. the hits of a slower storage behind this cache
+        """
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def drop(self, uuid):
+        with self._lock:
+            for kind in list(self._kinds.get(uuid, ())):
+                self._remove((uuid, kind))
+
+        if self._shared:
+            self._shared.drop(uuid)
+
+    def stats(self):
+        entries, size = self._shared.stats() if self._shared else (0, 0)
+
+        with self._lock:
+            total = self._counters["hits"] + self._counters["misses"]
+            return dict(
+                entries=len(self._entries) + entries,
+                size=self.size + size,
+                max_bytes=self.max_bytes,
+                shared=bool(self._shared),
+                hit_rate=round(self._counters["hits"] / total, 4) if total else None,
+                **self._counters
+            )
+
+    def _put_local(self, uuid, value, size, kind):
+        with self._lock:
+            self._remove((uuid, kind))
+            self._entries[(uuid, kind)] = (value, size)
+            self._kinds.setdefault(uuid, set()).add(kind)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.size -= entry[1]
+        kinds = self._kinds[key[0]]
+        kinds.discard(key[1])
+        if not kinds:
+            del self._kinds[key[0]]
+
+
+class Shared_store:
+    """
+    The LRU entries in an SQLite file, for all the processes of a host;
+    the dict values are kept as JSON, but the payload, kept as is
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def get(self, uuid, kind):
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT value, payload FROM entries WHERE uuid = ? AND kind = ?", (uuid, kind)
+            ).fetchone()
+            if row is None:
+                return None
+
+            # NB the access time is only approximately recent, as it is not worth a write each time
+            db.execute(
+                "UPDATE entries SET used = ? WHERE uuid = ? AND kind = ? AND used < ?",
+                (time.time(), uuid, kind, time.time() - 1),
+            )
+            db.commit()
+
+        value = json.loads(row[0])
+        if row[1] is not None:
+            value["payload"] = bytes(row[1])
+        return value
+
+    def put(self, uuid, kind, value, size):
+        """
+        Returns:
+            number of the evicted entries (int)
+        """
+        value = dict(value)
+        payload = value.pop("payload") if isinstance(value.get("payload"), bytes) else None
+
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (uuid, kind, json.dumps(value), payload, size, time.time()),
+                )
+                total = db.execute("SELECT SUM(size) FROM entries").fetchone()[0] or 0
+                if total <= self.max_bytes:
+                    return 0
+
+                evicted = 0
+                for key, row_size in db.execute(
+                    "SELECT rowid, size FROM entries ORDER BY used"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    db.execute("DELETE FROM entries WHERE rowid = ?", (key,))
+                    total -= row_size
+                    evicted += 1
+                return evicted
+
+    def drop(self, uuid):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM entries WHERE uuid = ?", (uuid,))
+
+    def stats(self):
+        with self._lock:
+            count, size = self._connect().execute(
+                "SELECT COUNT(*), SUM(size) FROM entries"
+            ).fetchone()
+            return count, size or 0
+
+    def _connect(self):
+        """
+        A connection per process, as it cannot be inherited by a fork
+        """
+        if self._db is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=SHARED_TIMEOUT, check_same_thread=False)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = OFF")  # NB a cache may be lost
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    uuid TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    payload BLOB,
+                    size INTEGER NOT NULL,
+                    used REAL NOT NULL,
+                    PRIMARY KEY (uuid, kind)
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS i_used ON entries (used)")
+            db.commit()
+            self._db, self._pid = db, os.getpid()
+        return self._db
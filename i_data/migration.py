@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Data backfills accompanying the schema changes in migration.sql;
+usage: python -m i_data.migration <job>
+"""
+import sys
+import json
+import zlib
+import logging
+
+import numpy as np
+
+from i_data import Data_type
+from i_structures.struct_utils import (
+    ase_serialize,
+    ase_unserialize,
+    get_phase,
+    get_formulae,
+    structure_fingerprint,
+)
+from i_calculations.xrpd import (
+    decimate_pattern,
+    is_packed_pattern,
+    pattern_serialize,
+    pattern_to_list,
+)
+from utils import get_data_storage, pattern_index
+
+
+def migrate_structures(db):
+    """
+    Repack the legacy base64-pickled structures into the compact binary format
+    """
+    payloads, count = [], 0
+
+    for item in db.iter_items(Data_type.structure, fields=("content", "payload")):
+        if item["payload"] is not None or not item["content"]:
+            continue
+
+        try:
+            payloads.append((item["uuid"], ase_serialize(ase_unserialize(item["content"]))))
+        except Exception as exc:
+            logging.error("Cannot repack structure %s: %s" % (item["uuid"], exc))
+            continue
+
+        if len(payloads) >= 500:
+            db.update_payloads(payloads)
+            count += len(payloads)
+            payloads = []
+
+    db.update_payloads(payloads)
+    count += len(payloads)
+    logging.warning("Repacked %s structures" % count)
+
+
+def backfill_phases(db):
+    """
+    Populate the distinct phases from all the stored structures;
+    the formulae are computed by the batches
+    """
+    structures, count = [], 0
+
+    def flush(structures):
+        phases = []
+        for (uuid, ase_obj), formula in zip(structures, get_formulae(
+            [ase_obj for _, ase_obj in structures]
+        )):
+            try:
+                phase = get_phase(ase_obj, formula)
+            except Exception as exc:
+                logging.error("Cannot get phase of structure %s: %s" % (uuid, exc))
+                continue
+            if phase:
+                phases.append(phase)
+        db.put_phases(phases)
+        return len(phases)
+
+    for item in db.iter_items(Data_type.structure, fields=("content", "payload")):
+        try:
+            structures.append((item["uuid"], ase_unserialize(item["payload"] or item["content"])))
+        except Exception as exc:
+            logging.error("Cannot read structure %s: %s" % (item["uuid"], exc))
+            continue
+
+        if len(structures) >= 500:
+            count += flush(structures)
+            structures = []
+
+    count += flush(structures)
+    logging.warning("Processed %s phases" % count)
+
+
+def backfill_fingerprints(db):
+    """
+    Index the canonical fingerprints of all the stored structures;
+    NB the duplicates stored so far are kept
+    """
+    fingerprints, count = [], 0
+
+    for item in db.iter_items(Data_type.structure, fields=("content", "payload")):
+        try:
+            fingerprint = structure_fingerprint(ase_unserialize(item["payload"] or item["content"]))
+        except Exception as exc:
+            logging.error("Cannot fingerprint structure %s: %s" % (item["uuid"], exc))
+            continue
+
+        fingerprints.append((item["uuid"], fingerprint))
+
+        if len(fingerprints) >= 500:
+            db.update_fingerprints(fingerprints)
+            count += len(fingerprints)
+            fingerprints = []
+
+    db.update_fingerprints(fingerprints)
+    count += len(fingerprints)
+    logging.warning("Fingerprinted %s structures" % count)
+
+
+def migrate_patterns(db):
+    """
+    Repack the legacy JSON patterns into the float32 columns;
+    NB the legacy intensities were rounded, so the precision is not restored
+    """
+    patterns, count = [], 0
+
+    for item in db.iter_items(Data_type.pattern, fields=("content", "payload")):
+        if is_packed_pattern(item["payload"]):
+            continue
+
+        try:
+            if item["payload"]:
+                # the compressed JSON of the full-resolution pattern
+                pairs = json.loads(zlib.decompress(item["payload"]))
+            else:
+                pairs = json.loads(item["content"])
+
+            x, y = np.array(pairs, dtype=float).reshape(-1, 2).T
+            order = np.argsort(x, kind="stable")
+            x, y = x[order], y[order]
+            content = pattern_to_list(*decimate_pattern(x, y))
+            patterns.append((item["uuid"], content, pattern_serialize(x, y)))
+        except Exception as exc:
+            logging.error("Cannot repack pattern %s: %s" % (item["uuid"], exc))
+            continue
+
+        if len(patterns) >= 500:
+            db.update_patterns(patterns)
+            count += len(patterns)
+            patterns = []
+
+    db.update_patterns(patterns)
+    count += len(patterns)
+    logging.warning("Repacked %s patterns" % count)
+
+
+def index_patterns(db):
+    """
+    Rebuild the similarity index of all the stored patterns,
+    also compacting it after the removals
+    """
+    if not pattern_index:
+        logging.error("Similarity index is not configured")
+        return
+
+    count = pattern_index.rebuild(
+        (item["uuid"], item["payload"])
+        for item in db.iter_items(Data_type.pattern, fields=("payload",))
+    )
+    logging.warning("Indexed %s patterns" % count)
+
+
+JOBS = {
+    "structures": migrate_structures,
+    "phases": backfill_phases,
+    "fingerprints": backfill_fingerprints,
+    "patterns": migrate_patterns,
+    "similarity": index_patterns,
+}
+
+
+if __name__ == "__main__":
+    try:
+        job = JOBS[sys.argv[1]]
+    except (IndexError, KeyError):
+        sys.exit("USAGE: python -m i_data.migration <%s>" % "|".join(JOBS))
+
+    db = get_data_storage()
+    job(db)
+    db.close()
@@ -1 +1,39 @@
 ALTER TABLE backend_data_nodes ADD created_at TIMESTAMP DEFAULT NOW();
+
+ALTER TABLE backend_data_nodes ADD COLUMN IF NOT EXISTS content_hash UUID GENERATED ALWAYS AS (md5(content)::uuid) STORED;
+CREATE INDEX IF NOT EXISTS i_content_hash ON backend_data_nodes USING btree( content_hash );
+
+ALTER TABLE backend_data_nodes ADD COLUMN IF NOT EXISTS payload BYTEA;
+-- then run python -m i_data.migration structures
+
+ALTER TABLE backend_data_links
+    DROP CONSTRAINT IF EXISTS backend_data_links_source_id_fkey,
+    ADD CONSTRAINT backend_data_links_source_id_fkey FOREIGN KEY (source_id) REFERENCES backend_data_nodes (item_id) ON DELETE CASCADE,
+    DROP CONSTRAINT IF EXISTS backend_data_links_target_id_fkey,
+    ADD CONSTRAINT backend_data_links_target_id_fkey FOREIGN KEY (target_id) REFERENCES backend_data_nodes (item_id) ON DELETE CASCADE;
+
+CREATE SEQUENCE IF NOT EXISTS distinct_phases_phid_seq OWNED BY distinct_phases.phid;
+SELECT setval('distinct_phases_phid_seq', COALESCE(MAX(phid), 0) + 1, false) FROM distinct_phases;
+ALTER TABLE distinct_phases ALTER COLUMN phid SET DEFAULT nextval('distinct_phases_phid_seq');
+CREATE UNIQUE INDEX IF NOT EXISTS i_formula_spg ON distinct_phases USING btree( formula_txt, spg );
+-- then run python -m i_data.migration phases
+
+CREATE INDEX IF NOT EXISTS i_type_created ON backend_data_nodes USING btree( type, created_at, item_id );
+
+CREATE TABLE IF NOT EXISTS refined_structures (
+    hash       CHAR(40) PRIMARY KEY,
+    formula    VARCHAR NOT NULL,
+    payload    BYTEA NOT NULL,
+    phase      jsonb,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+ALTER TABLE refined_structures ADD COLUMN IF NOT EXISTS fingerprint CHAR(40);
+ALTER TABLE backend_data_nodes ADD COLUMN IF NOT EXISTS fingerprint CHAR(40);
+CREATE INDEX IF NOT EXISTS i_fingerprint ON backend_data_nodes USING btree( fingerprint ) WHERE fingerprint IS NOT NULL;
+-- then run python -m i_data.migration fingerprints
+
+-- the patterns are repacked into the float32 columns, no schema change:
+-- python -m i_data.migration patterns
+-- and then the similarity index of the patterns is built:
+-- python -m i_data.migration similarity
@@ -0,0 +1,164 @@
+"""
+A bounded thread-safe pool of the Data_storage connections;
+the connections are checked out per request and returned back,
+so that no TCP and auth handshake with Postgres is made each time
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+import pg8000
+
+from i_data import Data_storage
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class Data_storage_pool:
+    def __init__(
+        self,
+        size=10,
+        max_lifetime=3600,
+        timeout=10,
+        ping_after=30,
+        cache=None,
+        patterns=None,
+        **db_params
+    ):
+        """
+        Args:
+            size: (int) max number of the simultaneously open connections
+            max_lifetime: (float) seconds after which a connection is recycled
+            timeout: (float) seconds to wait for a free connection
+            ping_after: (float) idle seconds after which a connection is health-checked
+            cache: (object) Node_cache to be shared by all the connections
+            patterns: (object) Pattern_index to be shared by all the connections
+            db_params: (dict) as expected by Data_storage
+        """
+        self.size = int(size)
+        self.max_lifetime = float(max_lifetime)
+        self.timeout = float(timeout)
+        self.ping_after = float(ping_after)
+        self.cache = cache
+        self.patterns = patterns
+        self.db_params = db_params
+
+        self._idle = []  # LIFO, so that the warmest connection is reused first
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._counters = dict(
+            created=0, reused=0, recycled=0, broken=0, waited=0, timeouts=0, in_use=0
+        )
+
+    def checkout(self):
+        """
+        Borrow a healthy connection; a new one is only opened
+        if there are no idle connections and the pool is not exhausted
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count("waited")
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count("timeouts")
+                raise PoolExhausted("No free database connections in %ss" % self.timeout)
+
+        try:
+            db = self._take_idle()
+            if db:
+                self._count("reused")
+            else:
+                db = self._connect()
+
+        except Exception:
+            self._slots.release()
+            raise
+
+        db._checked_out = True
+        self._count("in_use")
+        return db
+
+    def checkin(self, db):
+        """
+        Return a connection back; the broken or outdated ones are discarded
+        """
+        if not db._checked_out:
+            return
+        db._checked_out = False
+
+        try:
+            if db.connection._in_transaction:
+                db.connection.rollback()
+
+        except (pg8000.exceptions.Error, OSError, AttributeError):
+            self._count("broken")
+            self._discard(db)
+
+        else:
+            if time.monotonic() - db._created_at > self.max_lifetime:
+                self._count("recycled")
+                self._discard(db)
+            else:
+                db._released_at = time.monotonic()
+                with self._lock:
+                    self._idle.append(db)
+
+        with self._lock:
+            self._counters["in_use"] -= 1
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        db = self.checkout()
+        try:
+            yield db
+        finally:
+            self.checkin(db)
+
+    def stats(self):
+        with self._lock:
+            return dict(size=self.size, idle=len(self._idle), **self._counters)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for db in idle:
+            self._discard(db)
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                db = self._idle.pop()
+
+            now = time.monotonic()
+            if now - db._created_at > self.max_lifetime:
+                self._count("recycled")
+                self._discard(db)
+                continue
+
+            if now - db._released_at > self.ping_after and not db.ping():
+                self._count("broken")
+                self._discard(db)
+                continue
+
+            return db
+
+    def _connect(self):
+        db = Data_storage(cache=self.cache, patterns=self.patterns, **self.db_params)
+        db._pool = self
+        db._created_at = db._released_at = time.monotonic()
+        self._count("created")
+        return db
+
+    def _discard(self, db):
+        db._pool = None
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
@@ -0,0 +1,337 @@
+"""
+A nearest-neighbour index of the XRPD patterns, projected onto the fixed 2theta grid;
+the vectors are kept in an append-only on-disk float16 matrix, together with
+the node uuids, and the similarities are computed by the batched matrix products;
+the vectors of the dropped patterns are zeroed in place, rebuild() compacts the matrix
+"""
+import os
+import fcntl
+import threading
+from uuid import UUID
+from contextlib import contextmanager
+
+import numpy as np
+
+from i_calculations.xrpd import pattern_unserialize, project_pattern, SIMILARITY_GRID
+
+
+METRICS = ("cosine", "pearson")
+SEARCH_CHUNK_ROWS = 16384
+
+
+class Pattern_index:
+    def __init__(self, path, grid=SIMILARITY_GRID):
+        """
+        Args:
+            path: (str) matrix file, shared by all the processes
+            grid: (array) 2theta grid of the vectors
+        """
+        self.path = path
+        self.grid = grid
+        self.dtype = np.dtype([("uuid", "u1", (16,)), ("vector", "<f2", (len(grid),))])
+
+        self._lock = threading.Lock()
+        self._counters = dict(added=0, dropped=0, searches=0)
+        self._reset(None)
+
+    def add(self, items):
+        """
+        Index the patterns; the ones already indexed or not projectable are skipped
+
+        Args:
+            items: (list) of (uuid, payload) tuples, where payload is a packed pattern
+
+        Returns:
+            number of the added patterns (int)
+        """
+        rows = self._to_rows(items)
+        if not len(rows):
+            return 0
+
+        with self._lock, self._file_lock():
+            self._refresh()
+            fresh, seen = [], set(self._rows)
+            for row in rows:
+                uuid = self._from_bytes(row["uuid"])
+                fresh.append(uuid not in seen)
+                seen.add(uuid)
+            rows = rows[np.array(fresh, dtype=bool)]
+
+            # NB a partial row left by a crash is overwritten
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                os.pwrite(fd, rows.tobytes(), len(self._uuids) * self.dtype.itemsize)
+            finally:
+                os.close(fd)
+
+            self._refresh()
+            self._counters["added"] += len(rows)
+
+        return len(rows)
+
+    def drop(self, uuids):
+        """
+        Zero the vectors of the dropped patterns in place;
+        NB their uuids are kept, so that a concurrent rebuild() skips them
+
+        Returns:
+            number of the dropped patterns (int)
+        """
+        with self._lock, self._file_lock():
+            self._refresh()
+            rows = [self._rows.pop(str(uuid)) for uuid in uuids if str(uuid) in self._rows]
+            if not rows:
+                return 0
+
+            offset = self.dtype.fields["vector"][1]
+            blank = bytes(self.dtype.itemsize - offset)
+            fd = os.open(self.path, os.O_WRONLY)
+            try:
+                for row in rows:
+                    os.pwrite(fd, blank, row * self.dtype.itemsize + offset)
+                    self._uuids[row] = None
+                    self._valid[row] = False
+            finally:
+                os.close(fd)
+
+            self._counters["dropped"] += len(rows)
+
+        return len(rows)
+
+    def get(self, uuid):
+        """
+        Returns:
+            vector of an indexed pattern (float32 array) *or* None
+        """
+        with self._lock:
+            self._refresh()
+            row = self._rows.get(str(uuid))
+            if row is None:
+                return None
+            vector = self._matrix["vector"][row].astype(np.float32)
+            if not vector.any():
+                # NB dropped by another process, see _forget
+                self._forget(row)
+                return None
+            return vector
+
+    def search(self, vector, limit=10, metric="cosine", exclude=()):
+        """
+        Top-k of the most similar patterns
+
+        Args:
+            vector: (array) query, as given by project_pattern
+            limit: (int) k
+            metric: (str) cosine *or* pearson
+            exclude: (list) uuids not to be given, e.g. the query itself
+
+        Returns:
+            list of (uuid, similarity) tuples, the most similar first
+        """
+        assert metric in METRICS
+
+        with self._lock:
+            self._refresh()
+            matrix, uuids = self._matrix, self._uuids
+            count = len(uuids)
+            means, valid = self._means[:count], self._valid[:count].copy()
+            for uuid in exclude:
+                row = self._rows.get(str(uuid))
+                if row is not None:
+                    valid[row] = False
+            self._counters["searches"] += 1
+
+        if not count:
+            return []
+
+        vector = np.asarray(vector, dtype=np.float32)
+        if not vector.any():
+            return []
+
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            chunk = matrix["vector"][start:start + SEARCH_CHUNK_ROWS].astype(np.float32)
+            scores[start:start + len(chunk)] = chunk @ vector
+
+        # NB the rows dropped by another process are zeroed, see _forget,
+        # so only the rows of the zero products are checked
+        for row in np.flatnonzero(valid & (scores == 0)):
+            valid[row] = matrix["vector"][row].any()
+
+        if metric == "pearson":
+            # NB the vectors are unit, so that the centered products are derived
+            # from the plain ones and the means
+            width, query_mean = len(vector), vector.mean()
+            numerator = scores - width * query_mean * means
+            denominator = np.sqrt(
+                np.clip((1 - width * query_mean ** 2) * (1 - width * means ** 2), 0, None)
+            )
+            scores = np.divide(
+                numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0
+            )
+
+        scores[~valid] = -np.inf
+        limit = min(int(limit), int(valid.sum()))
+        if limit < 1:
+            return []
+
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(uuids[row], round(float(scores[row]), 4)) for row in top]
+
+    def rebuild(self, items):
+        """
+        Index all the patterns anew into a compact matrix, which then replaces
+        the current one; the writers are not blocked meanwhile, instead,
+        their changes made since the start are applied in the end
+
+        Args:
+            items: (iterable) of (uuid, payload) tuples
+
+        Returns:
+            number of the indexed patterns (int)
+        """
+        with self._lock:
+            self._refresh()
+            known = len(self._uuids)
+
+        tmp_path, positions, batch = self.path + ".tmp", {}, []
+
+        def flush(f, batch):
+            for row in self._to_rows(batch):
+                uuid = self._from_bytes(row["uuid"])
+                if uuid not in positions:
+                    positions[uuid] = len(positions)
+                    f.write(row.tobytes())
+
+        with open(tmp_path, "wb") as f:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= 500:
+                    flush(f, batch)
+                    batch = []
+            flush(f, batch)
+
+        with self._lock, self._file_lock():
+            self._refresh()
+            offset = self.dtype.fields["vector"][1]
+            blank = bytes(self.dtype.itemsize - offset)
+
+            with open(tmp_path, "r+b") as f:
+                for row in np.flatnonzero(~self._valid):
+                    uuid = self._from_bytes(self._matrix["uuid"][row])
+                    if uuid in positions:
+                        f.seek(positions[uuid] * self.dtype.itemsize + offset)
+                        f.write(blank)
+
+                for row in range(known, len(self._uuids)):
+                    uuid = self._uuids[row]
+                    if uuid and uuid not in positions:
+                        f.seek(len(positions) * self.dtype.itemsize)
+                        f.write(self._matrix[row].tobytes())
+                        positions[uuid] = len(positions)
+
+            os.replace(tmp_path, self.path)
+            self._refresh()
+            return len(self._rows)
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return dict(
+                patterns=len(self._rows),
+                rows=len(self._uuids),
+                size=len(self._uuids) * self.dtype.itemsize,
+                **self._counters
+            )
+
+    def _to_rows(self, items):
+        uuids, vectors = [], []
+        for uuid, payload in items:
+            try:
+                vector = project_pattern(*pattern_unserialize(payload), grid=self.grid)
+            except (TypeError, ValueError):
+                continue
+            if vector is not None:
+                uuids.append(np.frombuffer(UUID(str(uuid)).bytes, dtype=np.uint8))
+                vectors.append(vector)
+
+        rows = np.zeros(len(vectors), dtype=self.dtype)
+        if vectors:
+            rows["uuid"], rows["vector"] = uuids, vectors
+        return rows
+
+    @staticmethod
+    def _from_bytes(raw):
+        return str(UUID(bytes=raw.tobytes())) if raw.any() else None
+
+    def _reset(self, identity):
+        self._identity = identity
+        self._matrix = None
+        self._uuids = []  # row -> uuid *or* None, if dropped
+        self._rows = {}  # uuid -> row
+        self._means = np.zeros(0, dtype=np.float32)
+        self._valid = np.zeros(0, dtype=bool)
+
+    def _refresh(self):
+        """
+        Catch up with the rows appended by any process;
+        a replaced (i.e. rebuilt) matrix is read anew
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset(None)
+            return
+
+        identity, count = (stat.st_dev, stat.st_ino), stat.st_size // self.dtype.itemsize
+        if identity != self._identity or count < len(self._uuids):
+            self._reset(identity)
+
+        known = len(self._uuids)
+        if count == known:
+            return
+
+        self._matrix = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(count,))
+        means = np.concatenate([
+            self._matrix["vector"][start:start + SEARCH_CHUNK_ROWS].mean(axis=1, dtype=np.float32)
+            for start in range(known, count, SEARCH_CHUNK_ROWS)
+        ])
+        # NB the vectors are non-negative, so only the zeroed ones have zero mean
+        valid = means > 0
+
+        uuids = [
+            self._from_bytes(raw) if ok else None
+            for raw, ok in zip(self._matrix["uuid"][known:], valid)
+        ]
+        for row, uuid in enumerate(uuids, start=known):
+            if uuid:
+                self._rows[uuid] = row
+
+        self._uuids = self._uuids + uuids
+        self._means = np.concatenate([self._means, means])
+        self._valid = np.concatenate([self._valid, valid])
+
+    def _forget(self, row):
+        """
+        Only the appended rows are caught up with by _refresh,
+        so the rows zeroed in place by another process are found out when read
+        """
+        uuid = self._uuids[row]
+        if uuid:
+            self._rows.pop(uuid, None)
+            self._uuids[row] = None
+            self._valid[row] = False
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        The writers of all the processes are serialized
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
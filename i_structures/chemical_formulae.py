@@ -1,16 +1,5 @@
-from collections import defaultdict
-
-from pyparsing import (
-    Suppress,
-    Regex,
-    Forward,
-    Group,
-    Optional,
-    OneOrMore,
-    oneOf,
-    ParseResults,
-    ParseException as FormulaError,
-)
+import re
+from functools import lru_cache
 
 from ase.data import chemical_symbols
 
@@ -19,55 +8,98 @@ common_chem_elements = " ".join(
     chemical_symbols[1:-16] + [chemical_symbols[-8]] + ["D", "T"]
 )  # H - No, Rg, D, T
 
+FORMULA_CACHE_SIZE = 4096
 
-def get_formula_parser(chemical_tokens):
-    LPAR, RPAR = map(Suppress, "[]")
-    index = Regex(r"\d+(\.\d*)?").setParseAction(lambda t: float(t[0]))
-    element = oneOf(chemical_tokens)
-    chemical_formula = Forward()
-    term = Group(
-        (element | Group(LPAR + chemical_formula + RPAR)("subgroup"))
-        + Optional(index, default=1)("mult")
-    )
-    chemical_formula << OneOrMore(term)
-
-    def multiplyContents(tokens):
-        t = tokens[0]
-        if t.subgroup:
-            mult = t.mult
-            for term in t.subgroup:
-                term[1] *= mult
-            return t.subgroup
-
-    term.setParseAction(multiplyContents)
 
-    def sumByElement(tokens):
-        elementsList = [t[0] for t in tokens]
-        duplicates = len(elementsList) > len(set(elementsList))
-        if duplicates:
-            ctr = defaultdict(int)
-            for t in tokens:
-                ctr[t[0]] += t[1]
-            return ParseResults([ParseResults([k, v]) for k, v in ctr.items()])
+class FormulaError(ValueError):
+    pass
 
-    chemical_formula.setParseAction(sumByElement)
 
-    return chemical_formula
-
-
-standard_parser = get_formula_parser(common_chem_elements)
-lowercase_parser = get_formula_parser(common_chem_elements.lower())
+def get_formula_tokenizer(chemical_tokens):
+    """
+    The longest element symbols go first, so that e.g. Cl is never taken for C;
+    NB the whitespaces between the tokens are ignored
+    """
+    elements = sorted(chemical_tokens.split(), key=len, reverse=True)
+    return re.compile(
+        r"[ \t\n\r]*(?:(\[)|(\])|(\d+(?:\.\d*)?)|(%s))" % "|".join(map(re.escape, elements))
+    )
 
 
-def parse_formula(aux, lowercase=False, remove_isotopes=True):
+standard_tokenizer = get_formula_tokenizer(common_chem_elements)
+lowercase_tokenizer = get_formula_tokenizer(common_chem_elements.lower())
+
+
+def tokenize_formula(aux, tokenizer):
+    """
+    Tokens as (kind, value) tuples, where kind is one of [ ] index element;
+    everything after the first unrecognized character is ignored
+    """
+    tokens, pos = [], 0
+    while True:
+        match = tokenizer.match(aux, pos)
+        if not match:
+            break
+        pos = match.end()
+        lpar, rpar, index, element = match.groups()
+        if lpar:
+            tokens.append(("[", None))
+        elif rpar:
+            tokens.append(("]", None))
+        elif index:
+            tokens.append(("index", float(index)))
+        else:
+            tokens.append(("element", element))
+
+    tokens.append((None, None))
+    return tokens
+
+
+def parse_terms(tokens, pos):
+    """
+    Sequence of the terms, i.e. the elements or the square-bracket groups,
+    optionally followed by the index; the counts are summed by element
+
+    Returns:
+        counts (dict) *or* None, if there are no terms
+        position after the last term (int)
+    """
+    counts = {}
+    while True:
+        kind, value = tokens[pos]
+
+        if kind == "element":
+            term, pos = {value: 1}, pos + 1
+
+        elif kind == "[":
+            term, end = parse_terms(tokens, pos + 1)
+            if term is None or tokens[end][0] != "]":
+                break
+            pos = end + 1
+
+        else:
+            break
+
+        if tokens[pos][0] == "index":
+            mult, pos = tokens[pos][1], pos + 1
+            term = {el: (mult if kind == "element" else count * mult) for el, count in term.items()}
+
+        for el, count in term.items():
+            counts[el] = counts.get(el, 0) + count
+
+    return counts or None, pos
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def _parse_formula(aux, lowercase, remove_isotopes):
     if "(" in aux:
         raise FormulaError("Round brackets are not supported")
-    result = (
-        lowercase_parser.parseString(aux)
-        if lowercase
-        else standard_parser.parseString(aux)
+
+    result, _ = parse_terms(
+        tokenize_formula(aux, lowercase_tokenizer if lowercase else standard_tokenizer), 0
     )
-    result = dict(result.asList())
+    if result is None:
+        raise FormulaError("Not a chemical formula: %s" % aux)
 
     if remove_isotopes:
         # take care of D and T
@@ -75,15 +107,35 @@ def parse_formula(aux, lowercase=False, remove_isotopes=True):
             result["H"] = (
                 result.get("H", 0.0) + result.get("D", 0.0) + result.get("T", 0.0)
             )
+            result.pop("D", None)
+            result.pop("T", None)
 
-            try:
-                del result["D"]
-            except KeyError:
-                pass
+    return result
 
-            try:
-                del result["T"]
-            except KeyError:
-                pass
 
-    return result
+def parse_formula(aux, lowercase=False, remove_isotopes=True):
+    """
+    Parse the chemical formula, e.g. Sr[TiO3]2 or H2O0.5,
+    into the dict of elements and their (float) counts;
+    memoized, so a copy is returned
+
+    Raises:
+        FormulaError
+    """
+    return dict(_parse_formula(aux, lowercase, remove_isotopes))
+
+
+def parse_formulae(formulae, lowercase=False, remove_isotopes=True):
+    """
+    Parse many chemical formulae at once
+
+    Returns:
+        list of dicts, see parse_formula, *or* None for the invalid formulae
+    """
+    results = []
+    for aux in formulae:
+        try:
+            results.append(parse_formula(aux, lowercase, remove_isotopes))
+        except FormulaError:
+            results.append(None)
+    return results
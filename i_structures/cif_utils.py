@@ -1,4 +1,4 @@
-import tempfile  # FIXME remove as soon as pycodcif deals with the file in string
+import tempfile  # NB only for the pycodcif fallback, see read_cif
 import re
 #from io import StringIO
 
@@ -12,20 +12,127 @@ from ase.geometry import cell_to_cellpar
 #from ase.io import read as ase_read
 
 
-def cif_to_ase(cif_string):
+CIF_TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+
+
+def tokenize_cif(cif_string):
     """
-    Naive pycodcif usage
-    FIXME:
-    as soon as pycodcif supports CIFs as strings,
-    the tempfile below should be removed
+    Split CIF into the (value, is_quoted) tokens,
+    skipping comments and merging the semicolon text fields
 
-    Args:
-        cif_string: (str)
+    Yields:
+        tuple of token (str) and whether it was quoted (bool)
+    """
+    text_field = None
+
+    for line in cif_string.splitlines():
+        if text_field is not None:
+            if line.startswith(";"):
+                yield "\n".join(text_field), True
+                text_field = None
+                line = line[1:]
+            else:
+                text_field.append(line)
+                continue
+
+        elif line.startswith(";"):
+            text_field = [line[1:]]
+            continue
+
+        for match in CIF_TOKEN.finditer(line):
+            single, double, bare = match.groups()
+            if bare is None:
+                yield single if single is not None else double, True
+            elif bare.startswith("#"):
+                break
+            elif bare[0] in "'\"":
+                raise ValueError("Unterminated quoted value")
+            else:
+                yield bare, False
+
+    if text_field is not None:
+        raise ValueError("Unterminated text field")
+
+
+def parse_cif(cif_string):
+    """
+    In-memory CIF 1.1 reader for the plain data blocks,
+    similar to pycodcif output, i.e. [{"name": ..., "values": {tag: [value, ...]}}, ...];
+    the tags are lowercased
+
+    Raises:
+        ValueError for the unsupported or invalid syntax
+    """
+    blocks, values = [], None
+    loop_tags, loop_values, in_loop = None, None, False
+    tokens = tokenize_cif(cif_string)
+
+    def close_loop():
+        if loop_tags is None:
+            return
+        if not loop_tags or len(loop_values) % len(loop_tags):
+            raise ValueError("Inconsistent loop")
+        for n, tag in enumerate(loop_tags):
+            values[tag] = loop_values[n::len(loop_tags)]
+
+    for token, quoted in tokens:
+        keyword = token.lower()
+
+        if not quoted and keyword.startswith("data_"):
+            close_loop()
+            loop_tags, in_loop = None, False
+            values = {}
+            blocks.append(dict(name=token[5:], values=values))
+
+        elif not quoted and (keyword.startswith("save_") or keyword in ("global_", "stop_")):
+            raise ValueError("Unsupported CIF construct %s" % token)
+
+        elif values is None:
+            raise ValueError("Data outside of data block")
+
+        elif not quoted and keyword == "loop_":
+            close_loop()
+            loop_tags, loop_values, in_loop = [], [], True
+
+        elif not quoted and token.startswith("_"):
+            if in_loop and not loop_values:
+                loop_tags.append(keyword)
+                continue
+
+            close_loop()
+            loop_tags, in_loop = None, False
+            try:
+                value, _ = next(tokens)
+            except StopIteration:
+                raise ValueError("Missing value of %s" % token)
+            values[keyword] = [value]
+
+        elif in_loop and loop_tags:
+            loop_values.append(token)
+
+        else:
+            raise ValueError("Unexpected value %s" % token)
+
+    close_loop()
+    return blocks
+
+
+def read_cif(cif_string):
+    """
+    Parse CIF in memory; fall back to pycodcif
+    for what is not supported by the in-memory reader
 
     Returns:
-        ASE atoms (object) *or* None
+        CIF data blocks (list) *or* None
         None *or* error (str)
     """
+    try:
+        blocks = parse_cif(cif_string)
+    except ValueError:
+        blocks = None
+
+    if blocks:
+        return blocks, None
 
     # empty data_ keyword fixup
     for check in ["\ndata_\n", "\ndata_\r", "\rdata_\r"]:
@@ -38,59 +145,87 @@ def cif_to_ase(cif_string):
         tmp.flush()
 
         try:
-            parsed_cif = parse(tmp.name)[0][0]["values"]
+            return parse(tmp.name)[0], None
         except:
             return None, "Invalid or non-standard CIF"
 
-        if "_symmetry_int_tables_number" in parsed_cif:
-            try:
-                spacegroup = int(parsed_cif["_symmetry_int_tables_number"][0])
-            except ValueError:
-                return None, "Invalid space group info in CIF"
 
-        elif "_symmetry_space_group_name_h-m" in parsed_cif:
-            spacegroup = parsed_cif["_symmetry_space_group_name_h-m"][
-                0
-            ].strip()  # NB ase is very strict to whitespaces in HM symbols, so this is the most frequent error source
-            if not spacegroup:
-                return None, "Empty space group info in CIF"
+def cif_to_ase(cif_string):
+    """
+    Parse the first data block of CIF
 
-        else:
-            return None, "Absent space group info in CIF"
+    Args:
+        cif_string: (str)
 
+    Returns:
+        ASE atoms (object) *or* None
+        None *or* error (str)
+    """
+    blocks, error = read_cif(cif_string)
+    if error:
+        return None, error
+
+    return cif_values_to_ase(blocks[0]["values"])
+
+
+def cif_values_to_ase(parsed_cif):
+    """
+    Args:
+        parsed_cif: (dict) CIF tags and their values
+
+    Returns:
+        ASE atoms (object) *or* None
+        None *or* error (str)
+    """
+    if "_symmetry_int_tables_number" in parsed_cif:
         try:
-            cellpar = (
-                float(parsed_cif["_cell_length_a"][0].split("(")[0]),
-                float(parsed_cif["_cell_length_b"][0].split("(")[0]),
-                float(parsed_cif["_cell_length_c"][0].split("(")[0]),
-                float(parsed_cif["_cell_angle_alpha"][0].split("(")[0]),
-                float(parsed_cif["_cell_angle_beta"][0].split("(")[0]),
-                float(parsed_cif["_cell_angle_gamma"][0].split("(")[0]),
-            )
-            basis = np.transpose(
-                np.array(
+            spacegroup = int(parsed_cif["_symmetry_int_tables_number"][0])
+        except ValueError:
+            return None, "Invalid space group info in CIF"
+
+    elif "_symmetry_space_group_name_h-m" in parsed_cif:
+        spacegroup = parsed_cif["_symmetry_space_group_name_h-m"][
+            0
+        ].strip()  # NB ase is very strict to whitespaces in HM symbols, so this is the most frequent error source
+        if not spacegroup:
+            return None, "Empty space group info in CIF"
+
+    else:
+        return None, "Absent space group info in CIF"
+
+    try:
+        cellpar = (
+            float(parsed_cif["_cell_length_a"][0].split("(")[0]),
+            float(parsed_cif["_cell_length_b"][0].split("(")[0]),
+            float(parsed_cif["_cell_length_c"][0].split("(")[0]),
+            float(parsed_cif["_cell_angle_alpha"][0].split("(")[0]),
+            float(parsed_cif["_cell_angle_beta"][0].split("(")[0]),
+            float(parsed_cif["_cell_angle_gamma"][0].split("(")[0]),
+        )
+        basis = np.transpose(
+            np.array(
+                [
                     [
-                        [
-                            char.split("(")[0]
-                            for char in parsed_cif["_atom_site_fract_x"]
-                        ],
-                        [
-                            char.split("(")[0]
-                            for char in parsed_cif["_atom_site_fract_y"]
-                        ],
-                        [
-                            char.split("(")[0]
-                            for char in parsed_cif["_atom_site_fract_z"]
-                        ],
-                    ]
-                ).astype(np.float)
-            )
-            occupancies = [
-                float(occ.split("(")[0])
-                for occ in parsed_cif.get("_atom_site_occupancy", [])
-            ]
-        except:
-            return None, "Unexpected non-numerical values occured in CIF"
+                        char.split("(")[0]
+                        for char in parsed_cif["_atom_site_fract_x"]
+                    ],
+                    [
+                        char.split("(")[0]
+                        for char in parsed_cif["_atom_site_fract_y"]
+                    ],
+                    [
+                        char.split("(")[0]
+                        for char in parsed_cif["_atom_site_fract_z"]
+                    ],
+                ]
+            ).astype(float)
+        )
+        occupancies = [
+            float(occ.split("(")[0])
+            for occ in parsed_cif.get("_atom_site_occupancy", [])
+        ]
+    except:
+        return None, "Unexpected non-numerical values occured in CIF"
 
     symbols = parsed_cif.get("_atom_site_type_symbol")
 
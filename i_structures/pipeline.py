@@ -0,0 +1,67 @@
+"""
+The CPU-heavy structure processing, i.e. parse -> refine -> serialize;
+everything here is plain functions of picklable arguments,
+so that it can be run in the worker processes;
+parsing and refinement are separate steps, so that the latter can be memoized
+"""
+from i_structures.struct_utils import (
+    poscar_to_ase,
+    optimade_to_ase,
+    refine,
+    get_formula,
+    get_phase,
+    ase_serialize,
+    structure_fingerprint,
+)
+
+
+DISORDER_ERROR = "Structural disorder is currently not supported"
+
+
+def process_structure(ase_obj):
+    """
+    Refine, index, and serialize a parsed structure
+
+    Args:
+        ase_obj: (object) ASE structure
+
+    Returns:
+        dict of formula, payload, phase, and fingerprint *or* None
+        None *or* error (str)
+    """
+    if "disordered" in ase_obj.info:
+        return None, DISORDER_ERROR
+
+    ase_obj, error = refine(ase_obj, conventional_cell=True)
+    if error:
+        return None, error
+
+    formula = get_formula(ase_obj)
+    return (
+        dict(
+            formula=formula,
+            payload=ase_serialize(ase_obj),
+            phase=get_phase(ase_obj, formula),
+            fingerprint=structure_fingerprint(ase_obj),
+        ),
+        None,
+    )
+
+
+def parse_content(content, fmt):
+    """
+    Args:
+        content: (str) POSCAR or Optimade structure
+        fmt: (str) format
+
+    Returns:
+        ASE atoms (object) *or* None
+        None *or* error (str)
+    """
+    if fmt == "poscar":
+        return poscar_to_ase(content)
+
+    elif fmt == "optimade":
+        return optimade_to_ase(content)
+
+    return None, "Provided data format unsuitable or not recognized"
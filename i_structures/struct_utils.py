@@ -1,19 +1,25 @@
 import math
 import re
 import json
-import random
 import pickle
 import base64
-import itertools
-from functools import reduce
+import struct
+import hashlib
+from functools import reduce, lru_cache
 from io import StringIO
 
+import numpy as np
 from ase.atoms import Atom, Atoms
+from ase.data import atomic_numbers, chemical_symbols
 from ase.io.vasp import read_vasp
-from ase.spacegroup import crystal
+from ase.build import niggli_reduce
+from ase.geometry import cell_to_cellpar
+from ase.spacegroup import crystal, Spacegroup
 
 import spglib
 
+from i_structures import html_formula
+
 
 def detect_format(string):
     """
@@ -233,6 +239,73 @@ def refine(ase_obj, accuracy=1e-03, conventional_cell=False):
         return None, "Unrecognized sites or invalid site symmetry in structure"
 
 
+def structure_hash(ase_obj, accuracy=1e-03, conventional_cell=False):
+    """
+    Canonical hash of the parsed structure together with the refinement settings,
+    so that the refine() results can be memoized
+
+    Returns:
+        hex digest (str)
+    """
+    digest = hashlib.sha1(struct.pack("<d?", accuracy, conventional_cell))
+    for array, dtype in (
+        (ase_obj.cell[:], "<f8"),
+        (ase_obj.get_scaled_positions(wrap=False), "<f8"),
+        (ase_obj.numbers, "<u2"),
+    ):
+        if dtype == "<f8":
+            array = np.round(array, 8) + 0.0  # NB also turns -0.0 into 0.0
+        digest.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+    return digest.hexdigest()
+
+
+FINGERPRINT_TOLERANCE = dict(length=1e-02, angle=1e-01, position=1e-03)
+
+
+def structure_fingerprint(ase_obj, tolerance=FINGERPRINT_TOLERANCE):
+    """
+    Canonical fingerprint of a refined structure to find its duplicates,
+    whatever the source format: space group, Niggli-reduced cell,
+    and sorted fractional positions, all rounded within a tolerance
+
+    Returns:
+        hex digest (str)
+    """
+    sgn = getattr(ase_obj.info.get("spacegroup"), "no", 0)
+
+    reduced = ase_obj.copy()
+    reduced.pbc = True
+    niggli_reduce(reduced)
+
+    cellpar = cell_to_cellpar(reduced.cell)
+    lengths = np.round(cellpar[:3] / tolerance["length"])
+    angles = np.round(cellpar[3:] / tolerance["angle"])
+
+    # NB the origin is not unique, so every site of the rarest element is tried
+    # as the origin, and the least sorted positions are taken
+    grid = int(round(1 / tolerance["position"]))
+    numbers = reduced.numbers
+    scaled = reduced.get_scaled_positions(wrap=True)
+    elements, counts = np.unique(numbers, return_counts=True)
+    candidates = []
+    for origin in scaled[numbers == elements[np.argmin(counts)]]:
+        positions = np.round((scaled - origin) * grid).astype(np.int64) % grid
+        order = np.lexsort((positions[:, 2], positions[:, 1], positions[:, 0], numbers))
+        candidates.append(np.ascontiguousarray(positions[order], dtype="<i8").tobytes())
+
+    digest = hashlib.sha1(struct.pack("<H", sgn))
+    for array, dtype in (
+        (lengths, "<i8"),
+        (angles, "<i8"),
+        (np.sort(numbers), "<u2"),
+    ):
+        digest.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+    digest.update(min(candidates))
+
+    return digest.hexdigest()
+
+
 FORMULA_SEQUENCE = [
     "Fr",
     "Cs",
@@ -330,35 +403,97 @@ FORMULA_SEQUENCE = [
 ]
 
 
+FORMULA_RANKS = np.full(len(chemical_symbols), len(FORMULA_SEQUENCE), dtype=int)
+FORMULA_RANKS[[atomic_numbers[el] for el in FORMULA_SEQUENCE]] = np.arange(len(FORMULA_SEQUENCE))
+
+FORMULA_CACHE_SIZE = 8192
+
+
+def get_composition(numbers):
+    """
+    Args:
+        numbers: (array) atomic numbers
+
+    Returns:
+        (tuple) of (atomic number, count) pairs, in the order of appearance
+    """
+    numbers = np.asarray(numbers, dtype=int)
+    if not len(numbers):
+        return ()
+
+    elements, first = np.unique(numbers, return_index=True)
+    counts = np.bincount(numbers)[elements]
+    order = np.argsort(first)
+    return tuple(zip(elements[order].tolist(), counts[order].tolist()))
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def format_formula(composition, find_gcd=True):
+    """
+    Memoized formula of a composition, see get_composition;
+    the elements follow FORMULA_SEQUENCE, then the order of appearance
+    """
+    if not composition:
+        return ""
+
+    expanded = reduce(math.gcd, [count for _, count in composition]) if find_gcd else 1
+    composition = sorted(composition, key=lambda item: FORMULA_RANKS[item[0]])  # NB stable
+
+    return "".join(
+        chemical_symbols[number] + ("" if count == expanded else str(count // expanded))
+        for number, count in composition
+    )
+
+
 def get_formula(ase_obj, find_gcd=True, as_dict=False):
-    parsed_formula = {}
-
-    for label in ase_obj.get_chemical_symbols():
-        if label not in parsed_formula:
-            parsed_formula[label] = 1
-        else:
-            parsed_formula[label] += 1
-
-    expanded = reduce(math.gcd, parsed_formula.values()) if find_gcd else 1
-    if expanded > 1:
-        parsed_formula = {
-            el: int(content / float(expanded)) for el, content in parsed_formula.items()
-        }
+    composition = get_composition(ase_obj.numbers)
 
     if as_dict:
-        return parsed_formula
+        expanded = reduce(math.gcd, [count for _, count in composition], 0) if find_gcd else 1
+        return {
+            chemical_symbols[number]: count // (expanded or 1) for number, count in composition
+        }
 
-    atoms = parsed_formula.keys()
-    atoms = [x for x in FORMULA_SEQUENCE if x in atoms] + [
-        x for x in atoms if x not in FORMULA_SEQUENCE
-    ]
-    formula = ""
-    for atom in atoms:
-        index = parsed_formula[atom]
-        index = "" if index == 1 else str(index)
-        formula += atom + index
+    return format_formula(composition, find_gcd)
+
+
+def get_formulae(structures, find_gcd=True):
+    """
+    Formulae of many structures at once: the atoms of all the structures
+    are counted with a single bincount, and every distinct composition
+    is formatted only once
+
+    Args:
+        structures: (list) of ASE objects *or* arrays of atomic numbers
 
-    return formula
+    Returns:
+        formulae (list)
+    """
+    arrays = [np.asarray(getattr(item, "numbers", item), dtype=int) for item in structures]
+    if not arrays:
+        return []
+
+    width = len(chemical_symbols)
+    owners = np.repeat(np.arange(len(arrays)), [len(array) for array in arrays])
+    keys = owners * width + np.concatenate(arrays)
+
+    counts = np.bincount(keys, minlength=len(arrays) * width).reshape(len(arrays), width)
+    first = np.full(len(arrays) * width, len(keys))
+    np.minimum.at(first, keys, np.arange(len(keys)))
+    first = first.reshape(len(arrays), width)
+
+    # the (structure, element) pairs in the order of appearance, grouped by structure
+    rows, elements = np.nonzero(counts)
+    order = np.lexsort((first[rows, elements], rows))
+    rows, elements = rows[order], elements[order]
+    pairs = list(zip(elements.tolist(), counts[rows, elements].tolist()))
+    bounds = np.searchsorted(rows, np.arange(len(arrays) + 1)).tolist()
+
+    formulae = [
+        format_formula(tuple(pairs[bounds[n]:bounds[n + 1]]), find_gcd)
+        for n in range(len(arrays))
+    ]
+    return formulae
 
 
 def sgn_to_crsystem(number):
@@ -378,11 +513,66 @@ def sgn_to_crsystem(number):
         return "triclinic"
 
 
+CRYSTAL_SYSTEMS = [
+    "triclinic",
+    "monoclinic",
+    "orthorhombic",
+    "tetragonal",
+    "trigonal",
+    "hexagonal",
+    "cubic",
+]
+
+PEARSON_FAMILIES = {
+    "triclinic": "a",
+    "monoclinic": "m",
+    "orthorhombic": "o",
+    "tetragonal": "t",
+    "trigonal": "h",
+    "hexagonal": "h",
+    "cubic": "c",
+}
+
+
+def get_phase(ase_obj, formula=None):
+    """
+    Distinct phase definition, i.e. a formula within a space group;
+    NB the conventional cell is expected for the Pearson symbol
+
+    Returns:
+        dict *or* None, if the phase is too complex to be indexed
+    """
+    spacegroup = ase_obj.info.get("spacegroup", object)
+    sgn = getattr(spacegroup, "no", 1)
+    crsystem = sgn_to_crsystem(sgn)
+    centering = getattr(spacegroup, "symbol", "P")[0].upper()
+    if centering in "ABC":
+        centering = "C"
+
+    formula = formula or get_formula(ase_obj)
+    phase = dict(
+        elements="-".join(sorted(set(ase_obj.get_chemical_symbols()))),
+        formula_txt=formula,
+        formula_html=html_formula(formula),
+        spg=sgn,
+        pearson=PEARSON_FAMILIES[crsystem] + centering + str(len(ase_obj)),
+        crsystem=CRYSTAL_SYSTEMS.index(crsystem) + 1,
+    )
+    if (
+        len(phase["elements"]) > 64
+        or len(phase["formula_txt"]) > 128
+        or len(phase["formula_html"]) > 384
+        or len(phase["pearson"]) > 8
+    ):
+        return None
+    return phase
+
+
 MAX_ATOMS = 1000
 SITE_SUM_OCCS_TOL = 0.99
 
 
-def order_disordered(ase_obj):
+def order_disordered(ase_obj, seed=None):
     """
     This is a toy algo to get rid of the structural disorder;
     just one random possible ordered structure is returned
@@ -393,6 +583,7 @@ def order_disordered(ase_obj):
     Args:
         ase_obj: (object) ASE structure; must have *info* dict *disordered* and *Atom* tags
             *disordered* dict format: {'disordered': {at_index: {element: occupancy, ...}, ...}
+        seed: (int) random seed, if reproducibility is needed
 
     Returns:
         ASE structure (object) *or* None
@@ -401,15 +592,36 @@ def order_disordered(ase_obj):
     TODO?
     Rewrite space group info accordingly
     """
-    for index in ase_obj.info["disordered"]:
-        if sum(ase_obj.info["disordered"][index].values()) < SITE_SUM_OCCS_TOL:
-            ase_obj.info["disordered"][index].update(
-                {"X": 1 - sum(ase_obj.info["disordered"][index].values())}
-            )
+    ordered, error = order_disordered_samples(ase_obj, 1, seed=seed)
+    if error:
+        return None, error
 
-    min_occ = min(
-        sum([list(item.values()) for item in ase_obj.info["disordered"].values()], [])
-    )
+    return ordered[0], None
+
+
+def order_disordered_samples(ase_obj, samples, seed=None):
+    """
+    Many independent random ordered structures at once, see order_disordered;
+    the supercell is built only once, then for each sample
+    all the sites are assigned in one pass and the vacancies are removed by a mask
+
+    Args:
+        ase_obj: (object) ASE structure, as for order_disordered
+        samples: (int) number of the ordered structures
+        seed: (int) random seed, if reproducibility is needed
+
+    Returns:
+        ASE structures (list) *or* None
+        None *or* error (str)
+    """
+    disordered = {}
+    for index, occs in ase_obj.info["disordered"].items():
+        occs = dict(occs)
+        if sum(occs.values()) < SITE_SUM_OCCS_TOL:
+            occs["X"] = 1 - sum(occs.values())
+        disordered[index] = occs
+
+    min_occ = min(occ for occs in disordered.values() for occ in occs.values())
     if min_occ == 0:
         return None, "Zero occupancy is encountered"
 
@@ -421,61 +633,180 @@ def order_disordered(ase_obj):
     supercell_matrix = [int(x) for x in (round(diag), math.ceil(diag), math.ceil(diag))]
     actual_det = reduce(lambda x, y: x * y, supercell_matrix)
 
-    occ_data = {}
-    for index, occs in ase_obj.info["disordered"].items():
-        disorder = []
-        for el, occ in occs.items():
-            disorder += [el] * int(round(occ * actual_det))
-        random.shuffle(disorder)
-        occ_data[index] = itertools.cycle(disorder)
-
-    order_obj = ase_obj.copy()
-    order_obj *= supercell_matrix
-    del order_obj.info["disordered"]
-
-    for index, occs in occ_data.items():
-        for n in range(len(order_obj) - 1, -1, -1):
-            if order_obj[n].tag == index:
-                distrib_el = next(occs)
-                if distrib_el == "X":
-                    del order_obj[n]
-                else:
-                    try:
-                        order_obj[n].symbol = distrib_el
-                    except KeyError as exc:
-                        return None, "Unrecognized atom symbol: %s" % exc
-
-    return order_obj, None
+    supercell = ase_obj.copy()
+    supercell *= supercell_matrix
+    del supercell.info["disordered"]
+
+    # the atoms of every disordered site (in the order of the initial algo),
+    # and the multiset of the elements (as atomic numbers, 0 for vacancy) to distribute
+    tags = supercell.get_tags()
+    sites = []
+    for index, occs in disordered.items():
+        try:
+            distribution = np.concatenate([
+                np.full(int(round(occ * actual_det)), atomic_numbers[el], dtype=int)
+                for el, occ in occs.items()
+            ])
+        except KeyError as exc:
+            return None, "Unrecognized atom symbol: %s" % exc
+
+        sites.append((np.nonzero(tags == index)[0][::-1], distribution))
+
+    rng = np.random.default_rng(seed)
+    ordered = []
+
+    for _ in range(samples):
+        numbers = supercell.numbers.copy()
+        vacancies = np.zeros(len(supercell), dtype=bool)
+
+        for atoms, distribution in sites:
+            if not len(atoms) or not len(distribution):
+                continue
+            assigned = np.resize(rng.permutation(distribution), len(atoms))
+            numbers[atoms] = assigned
+            vacancies[atoms] = assigned == 0
+
+        order_obj = supercell[~vacancies]
+        order_obj.numbers = numbers[~vacancies]
+        ordered.append(order_obj)
+
+    return ordered, None
 
 
 def extract_chemical_element(str):
     return re.sub("\W", "", str)
 
 
+PACKED_MAGIC = b"MTS"
+PACKED_VERSION = 1
+PACKED_HEADER = struct.Struct("<3sBBHBI")  # magic, version, flags, space group, setting, atoms
+
+PACKED_FLAG_CONVENTIONAL = 1 << 3
+PACKED_FLAG_KINDS = 1 << 4
+PACKED_FLAG_INFO = 1 << 5
+PACKED_INFO_LEN = struct.Struct("<I")
+PACKED_INFO_SKIPPED = ("spacegroup", "unit_cell")  # kept in the header
+
+
 def ase_serialize(ase_obj):
-    return base64.b64encode(pickle.dumps(ase_obj, protocol=4)).decode("ascii")
+    """
+    Versioned compact binary format:
+    header, cell (9 x float64), atomic numbers (uint8),
+    cartesian positions (N x 3 x float64), optionally
+    the space group kinds of sites (uint16), optionally
+    the other info entries as JSON (its length as uint32 first);
+    NB the info entries not serializable to JSON are dropped,
+    and the keys of the dicts in there become strings
+    """
+    flags = sum(1 << n for n, periodic in enumerate(ase_obj.pbc) if periodic)
+    if ase_obj.info.get("unit_cell") == "conventional":
+        flags |= PACKED_FLAG_CONVENTIONAL
 
+    kinds = ase_obj.arrays.get("spacegroup_kinds")
+    if kinds is not None:
+        flags |= PACKED_FLAG_KINDS
 
-def ase_unserialize(string):
-    return pickle.loads(base64.b64decode(string))
+    spacegroup = ase_obj.info.get("spacegroup")
 
+    info = {}
+    for key, value in ase_obj.info.items():
+        if key in PACKED_INFO_SKIPPED:
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        info[key] = value
+
+    info = json.dumps(info).encode("utf-8") if info else b""
+    if info:
+        flags |= PACKED_FLAG_INFO
+
+    return b"".join(
+        [
+            PACKED_HEADER.pack(
+                PACKED_MAGIC,
+                PACKED_VERSION,
+                flags,
+                getattr(spacegroup, "no", 0),
+                getattr(spacegroup, "setting", 0),
+                len(ase_obj),
+            ),
+            np.ascontiguousarray(ase_obj.cell[:], dtype="<f8").tobytes(),
+            np.ascontiguousarray(ase_obj.numbers, dtype="u1").tobytes(),
+            np.ascontiguousarray(ase_obj.positions, dtype="<f8").tobytes(),
+        ]
+        + ([np.ascontiguousarray(kinds, dtype="<u2").tobytes()] if kinds is not None else [])
+        + ([PACKED_INFO_LEN.pack(len(info)), info] if info else [])
+    )
 
-if __name__ == "__main__":
-    from ase.spacegroup import crystal
 
-    crystal_obj = crystal(
-        ("Sr", "Ti", "O", "O"),
-        basis=[(0, 0.5, 0.25), (0, 0, 0), (0, 0, 0.25), (0.255, 0.755, 0)],
-        spacegroup=140,
-        cellpar=[5.511, 5.511, 7.796, 90, 90, 90],
-        primitive_cell=True,
+def structure_unpack(data):
+    """
+    Decode the compact binary format straight into
+    numpy arrays (read-only views of the data), without building ASE object
+
+    Returns:
+        dict with the *numbers*, *positions*, *cell*, *pbc*, *kinds* arrays
+        and the *spacegroup*, *setting*, *conventional*, *info* values
+    """
+    data = memoryview(data)
+    magic, version, flags, spg_no, setting, natoms = PACKED_HEADER.unpack_from(data)
+    if magic != PACKED_MAGIC or version != PACKED_VERSION:
+        raise ValueError("Unsupported structure format")
+
+    offset = PACKED_HEADER.size
+    cell = np.frombuffer(data, dtype="<f8", count=9, offset=offset).reshape(3, 3)
+    offset += 9 * 8
+    numbers = np.frombuffer(data, dtype="u1", count=natoms, offset=offset)
+    offset += natoms
+    positions = np.frombuffer(data, dtype="<f8", count=natoms * 3, offset=offset).reshape(natoms, 3)
+    offset += natoms * 3 * 8
+    kinds = (
+        np.frombuffer(data, dtype="<u2", count=natoms, offset=offset)
+        if flags & PACKED_FLAG_KINDS else None
+    )
+    info = {}
+    if flags & PACKED_FLAG_INFO:
+        offset += natoms * 2 if kinds is not None else 0
+        (length,) = PACKED_INFO_LEN.unpack_from(data, offset)
+        offset += PACKED_INFO_LEN.size
+        info = json.loads(bytes(data[offset:offset + length]).decode("utf-8"))
+
+    return dict(
+        numbers=numbers,
+        positions=positions,
+        cell=cell,
+        pbc=[bool(flags & (1 << n)) for n in range(3)],
+        kinds=kinds,
+        spacegroup=spg_no,
+        setting=setting,
+        conventional=bool(flags & PACKED_FLAG_CONVENTIONAL),
+        info=info,
     )
-    # print(crystal_obj)
 
-    repr = ase_serialize(crystal_obj)
-    # print(repr)
 
-    new_obj = ase_unserialize(repr)
-    # print(new_obj)
+def ase_unserialize(data):
+    """
+    Build ASE object from either the compact binary format (bytes)
+    or the legacy base64-encoded pickle (str)
+    """
+    if isinstance(data, str):
+        return pickle.loads(base64.b64decode(data))
+
+    unpacked = structure_unpack(data)
+    ase_obj = Atoms(
+        numbers=unpacked["numbers"],
+        positions=unpacked["positions"],
+        cell=unpacked["cell"],
+        pbc=unpacked["pbc"],
+    )
+    if unpacked["kinds"] is not None:
+        ase_obj.new_array("spacegroup_kinds", unpacked["kinds"].astype(int))
+    ase_obj.info.update(unpacked["info"])
+    if unpacked["spacegroup"]:
+        ase_obj.info["spacegroup"] = Spacegroup(unpacked["spacegroup"], unpacked["setting"])
+    ase_obj.info["unit_cell"] = "conventional" if unpacked["conventional"] else "primitive"
+
+    return ase_obj
 
-    assert new_obj == crystal_obj
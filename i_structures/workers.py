@@ -0,0 +1,181 @@
+"""
+A bounded pool of the worker processes for the CPU-heavy structure processing,
+so that a pathological structure never blocks the server workers;
+the tasks are expected to return (result, error) tuples;
+NB the task is awaited by the server, which is single-threaded,
+so the wait is capped, and a stuck task is killed together with its executor
+"""
+import time
+import threading
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+MAX_TIMEOUT = 30
+DEFAULT_TASK = "Structure processing"
+
+
+class Worker_error(str):
+    """
+    An error of the pool, not of the task, i.e. not due to the input,
+    hence given with its own HTTP status
+    """
+    def __new__(cls, message, status):
+        error = super().__new__(cls, message)
+        error.status = status
+        return error
+
+
+BUSY_ERROR = Worker_error("Server is too busy, please try again later", 503)
+TIMEOUT_ERROR = "%s took too long"
+FAILED_ERROR = "%s failed unexpectedly"
+
+
+class Worker_pool:
+    def __init__(self, size=4, queue_size=64, timeout=30):
+        """
+        Args:
+            size: (int) number of the worker processes
+            queue_size: (int) max number of the tasks waiting for a free worker
+            timeout: (float) seconds a task may take, including the wait in the queue,
+                at most MAX_TIMEOUT
+        """
+        self.size = int(size)
+        self.queue_size = int(queue_size)
+        self.timeout = min(float(timeout), MAX_TIMEOUT)
+
+        self._slots = threading.BoundedSemaphore(self.size + self.queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._counters = dict(done=0, busy=0, timeouts=0, failed=0, pending=0)
+
+    def run(self, func, *args, task=DEFAULT_TASK):
+        """
+        Run a task in a worker process and wait for it
+
+        Args:
+            task: (str) what the task does, for the error messages
+
+        Returns:
+            The task result *or* None
+            None *or* error (str)
+        """
+        job = self._submit(func, args, wait=False)
+        if job is None:
+            return None, BUSY_ERROR
+
+        return self._result(*job, task=task)
+
+    def map(self, func, iterable, task=DEFAULT_TASK):
+        """
+        Run a task for each argument, keeping their order; unlike run(),
+        a free slot in the queue is awaited, so that a big batch
+        is streamed through the pool without overfilling the queue
+
+        Returns:
+            list of the task results *or* (None, error) tuples
+        """
+        jobs, busy = [], False
+        for arg in iterable:
+            job = None if busy else self._submit(func, (arg,), wait=True)
+            busy = job is None
+            jobs.append(job)
+
+        return [
+            self._result(*job, task=task) if job else (None, BUSY_ERROR)
+            for job in jobs
+        ]
+
+    def stats(self):
+        with self._lock:
+            return dict(size=self.size, queue_size=self.queue_size, **self._counters)
+
+    def close(self):
+        self._reset(self._executor)
+
+    def _submit(self, func, args, wait):
+        acquired = (
+            self._slots.acquire(timeout=self.timeout)
+            if wait
+            else self._slots.acquire(blocking=False)
+        )
+        if not acquired:
+            self._count("busy")
+            return None
+
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(func, *args)
+            except BrokenProcessPool:
+                self._reset(executor)
+                executor = self._get_executor()
+                future = executor.submit(func, *args)
+
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._count("pending")
+        future.add_done_callback(self._release)
+        return future, time.monotonic() + self.timeout, executor
+
+    def _release(self, future):
+        with self._lock:
+            self._counters["pending"] -= 1
+        self._slots.release()
+
+    def _result(self, future, deadline, executor, task=DEFAULT_TASK):
+        try:
+            result = future.result(timeout=max(0, deadline - time.monotonic()))
+
+        except TimeoutError:
+            # NB a running task cannot be cancelled, so its worker is killed,
+            # which also fails the other tasks of the executor, and frees their slots
+            if not future.cancel():
+                self._reset(executor, kill=True)
+            self._count("timeouts")
+            return None, Worker_error(TIMEOUT_ERROR % task, 504)
+
+        except BrokenProcessPool:
+            self._reset(executor)
+            self._count("failed")
+            return None, Worker_error(FAILED_ERROR % task, 503)
+
+        except Exception:
+            self._count("failed")
+            return None, Worker_error(FAILED_ERROR % task, 503)
+
+        self._count("done")
+        return result
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # NB forkserver, as forking the threaded server process is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size, mp_context=get_context("forkserver")
+                )
+            return self._executor
+
+    def _reset(self, executor, kill=False):
+        """
+        A crashed (or killed) worker breaks the whole executor, so it is replaced
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            elif not kill:
+                return
+        if not executor:
+            return
+
+        if kill:
+            for process in list((executor._processes or {}).values()):
+                process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
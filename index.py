@@ -6,14 +6,24 @@ import logging
 from flask import Flask
 from netius.servers import WSGIServer
 
-from i_data.bp_data import bp_data
+from i_data.bp_data import bp_data, MAX_REQUEST_LEN
 from i_calculations.bp_calculations import bp_calculations
+from i_data.pool import PoolExhausted
+from utils import release_data_storage, fmt_msg
 
 
 app = Flask(__name__)
 app.debug = True
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_LEN  # rejected before parsing
 app.register_blueprint(bp_data)
 app.register_blueprint(bp_calculations)
+app.teardown_appcontext(release_data_storage)
+
+
+@app.errorhandler(PoolExhausted)
+def pool_exhausted(error):
+    return fmt_msg("Server is too busy, please try again later", 503)
+
 
 if __name__ == '__main__':
 
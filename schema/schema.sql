@@ -7,19 +7,29 @@ CREATE TABLE IF NOT EXISTS backend_data_nodes (
     content VARCHAR,
     type SMALLINT,
     created_at TIMESTAMP DEFAULT NOW(),
-    seen BOOLEAN DEFAULT FALSE
+    seen BOOLEAN DEFAULT FALSE,
+    payload BYTEA,
+    content_hash UUID GENERATED ALWAYS AS (md5(content)::uuid) STORED,
+    fingerprint CHAR(40)
 );
+-- the columns added since, as the table of an existing database is kept as is
+ALTER TABLE backend_data_nodes ADD COLUMN IF NOT EXISTS payload BYTEA;
+ALTER TABLE backend_data_nodes ADD COLUMN IF NOT EXISTS content_hash UUID GENERATED ALWAYS AS (md5(content)::uuid) STORED;
+ALTER TABLE backend_data_nodes ADD COLUMN IF NOT EXISTS fingerprint CHAR(40);
+CREATE INDEX IF NOT EXISTS i_content_hash ON backend_data_nodes USING btree( content_hash );
+CREATE INDEX IF NOT EXISTS i_fingerprint ON backend_data_nodes USING btree( fingerprint ) WHERE fingerprint IS NOT NULL;
+CREATE INDEX IF NOT EXISTS i_type_created ON backend_data_nodes USING btree( type, created_at, item_id );
 
 CREATE TABLE IF NOT EXISTS backend_data_links (
     source_id UUID NOT NULL,
     target_id UUID NOT NULL,
     PRIMARY KEY (source_id, target_id),
-    FOREIGN KEY (source_id) REFERENCES backend_data_nodes (item_id),
-    FOREIGN KEY (target_id) REFERENCES backend_data_nodes (item_id)
+    FOREIGN KEY (source_id) REFERENCES backend_data_nodes (item_id) ON DELETE CASCADE,
+    FOREIGN KEY (target_id) REFERENCES backend_data_nodes (item_id) ON DELETE CASCADE
 );
 
 CREATE TABLE IF NOT EXISTS distinct_phases (
-    phid         INT PRIMARY KEY,
+    phid         SERIAL PRIMARY KEY,
     elements     VARCHAR(64) NOT NULL,
     formula_txt  VARCHAR(128) NOT NULL,
     formula_html VARCHAR(384) NOT NULL,
@@ -29,3 +39,14 @@ CREATE TABLE IF NOT EXISTS distinct_phases (
 );
 CREATE INDEX IF NOT EXISTS i_phid ON distinct_phases USING btree( phid );
 CREATE INDEX IF NOT EXISTS i_elements ON distinct_phases USING btree( elements text_pattern_ops );
+CREATE UNIQUE INDEX IF NOT EXISTS i_formula_spg ON distinct_phases USING btree( formula_txt, spg );
+
+CREATE TABLE IF NOT EXISTS refined_structures (
+    hash       CHAR(40) PRIMARY KEY,
+    formula    VARCHAR NOT NULL,
+    payload    BYTEA NOT NULL,
+    phase      jsonb,
+    fingerprint CHAR(40),
+    created_at TIMESTAMP DEFAULT NOW()
+);
+ALTER TABLE refined_structures ADD COLUMN IF NOT EXISTS fingerprint CHAR(40);
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import set_path
+from ase.spacegroup import crystal
+from i_structures.struct_utils import ase_serialize, ase_unserialize, structure_unpack
+
+
+crystal_obj = crystal(
+    ("Sr", "Ti", "O", "O"),
+    basis=[(0, 0.5, 0.25), (0, 0, 0), (0, 0, 0.25), (0.255, 0.755, 0)],
+    spacegroup=140,
+    cellpar=[5.511, 5.511, 7.796, 90, 90, 90],
+    primitive_cell=True,
+)
+crystal_obj.info["name"] = "SrTiO3"
+crystal_obj.info["occupancy"] = {"0": {"Sr": 1.0}}
+crystal_obj.info["unserializable"] = object()
+
+repr = ase_serialize(crystal_obj)
+new_obj = ase_unserialize(repr)
+
+assert new_obj == crystal_obj
+assert new_obj.info["spacegroup"].no == 140
+assert new_obj.info["name"] == "SrTiO3"
+assert new_obj.info["occupancy"] == {"0": {"Sr": 1.0}}
+assert "unserializable" not in new_obj.info
+assert structure_unpack(repr)["info"] == dict(name="SrTiO3", occupancy={"0": {"Sr": 1.0}})
+
+del crystal_obj.info["name"], crystal_obj.info["occupancy"]
+assert ase_unserialize(ase_serialize(crystal_obj)) == crystal_obj
+print("OK")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+In-memory CIF reading vs. the pycodcif tempfile round trip
+"""
+import time
+import tempfile
+import logging
+
+from helpers import gen_cif
+
+import set_path
+from i_structures.cif_utils import parse_cif, parse
+
+
+NUM_ITERS = 200
+
+
+def read_via_tempfile(cif_string):
+    with tempfile.NamedTemporaryFile(suffix=".cif") as tmp:
+        tmp.write(cif_string.encode("utf-8"))
+        tmp.flush()
+        return parse(tmp.name)[0]
+
+
+def bench(func, cif_string):
+    start = time.perf_counter()
+    for _ in range(NUM_ITERS):
+        func(cif_string)
+    return (time.perf_counter() - start) / NUM_ITERS * 1000
+
+
+for num_atoms in (10, 100, 1000, 5000):
+    cif_string = gen_cif(num_atoms)
+    in_memory = bench(parse_cif, cif_string)
+    try:
+        via_tempfile = bench(read_via_tempfile, cif_string)
+    except Exception as exc:
+        logging.warning("pycodcif failed: %s" % exc)
+        via_tempfile = float("nan")
+
+    logging.warning(
+        "%s atoms, %s KB: in-memory %.3f ms, tempfile %.3f ms"
+        % (num_atoms, len(cif_string) // 1024, in_memory, via_tempfile)
+    )
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Hand-written chemical formula parser vs. the former pyparsing grammar;
+the results are also checked to be identical
+"""
+import time
+import random
+import logging
+from collections import defaultdict
+
+from helpers import gen_chem_formula
+
+import set_path
+from i_structures.chemical_formulae import (
+    common_chem_elements,
+    parse_formulae,
+    _parse_formula,
+    FORMULA_CACHE_SIZE,
+)
+
+
+NUM_FORMULAE = 20000
+
+
+def get_pyparsing_parser(chemical_tokens):
+    from pyparsing import Suppress, Regex, Forward, Group, Optional, OneOrMore, oneOf, ParseResults
+
+    LPAR, RPAR = map(Suppress, "[]")
+    index = Regex(r"\d+(\.\d*)?").setParseAction(lambda t: float(t[0]))
+    element = oneOf(chemical_tokens)
+    chemical_formula = Forward()
+    term = Group(
+        (element | Group(LPAR + chemical_formula + RPAR)("subgroup"))
+        + Optional(index, default=1)("mult")
+    )
+    chemical_formula << OneOrMore(term)
+
+    def multiplyContents(tokens):
+        t = tokens[0]
+        if t.subgroup:
+            mult = t.mult
+            for term in t.subgroup:
+                term[1] *= mult
+            return t.subgroup
+
+    term.setParseAction(multiplyContents)
+
+    def sumByElement(tokens):
+        elementsList = [t[0] for t in tokens]
+        duplicates = len(elementsList) > len(set(elementsList))
+        if duplicates:
+            ctr = defaultdict(int)
+            for t in tokens:
+                ctr[t[0]] += t[1]
+            return ParseResults([ParseResults([k, v]) for k, v in ctr.items()])
+
+    chemical_formula.setParseAction(sumByElement)
+
+    return chemical_formula
+
+
+def pyparsing_parse_formula(parser, aux):
+    if "(" in aux:
+        return None
+    try:
+        result = dict(parser.parseString(aux).asList())
+    except Exception:
+        return None
+
+    if "D" in result or "T" in result:
+        result["H"] = result.get("H", 0.0) + result.get("D", 0.0) + result.get("T", 0.0)
+        result.pop("D", None)
+        result.pop("T", None)
+    return result
+
+
+def gen_nested_formula(depth=2):
+    formula = gen_chem_formula()
+    for _ in range(depth):
+        formula = "%s[%s]%s" % (
+            random.choice(common_chem_elements.split()),
+            formula,
+            random.choice(["", "2", "0.5", "3.25"]),
+        )
+    return formula
+
+
+formulae = [gen_chem_formula() for _ in range(NUM_FORMULAE // 2)] + [
+    gen_nested_formula(random.randint(1, 3)) for _ in range(NUM_FORMULAE // 2)
+]
+formulae += ["D2O", "H[T2O]3", "Sr Ti O3", "Fe2O3x", "[Cu"]
+
+_parse_formula.cache_clear()
+start = time.perf_counter()
+results = parse_formulae(formulae)
+cold = time.perf_counter() - start
+
+repeated = formulae[:FORMULA_CACHE_SIZE] * 5
+start = time.perf_counter()
+parse_formulae(repeated)
+warm = time.perf_counter() - start
+
+logging.warning(
+    "Tokenizer: %.0f formulae/s, memoized: %.0f formulae/s"
+    % (len(formulae) / cold, len(repeated) / warm)
+)
+
+try:
+    parser = get_pyparsing_parser(common_chem_elements)
+except ImportError:
+    logging.warning("No pyparsing, skipping comparison")
+else:
+    start = time.perf_counter()
+    expected = [pyparsing_parse_formula(parser, aux) for aux in formulae]
+    logging.warning(
+        "Pyparsing: %.0f formulae/s" % (len(formulae) / (time.perf_counter() - start))
+    )
+    for aux, result, reference in zip(formulae, results, expected):
+        assert result == reference, (aux, result, reference)
+    logging.warning("Results are identical")
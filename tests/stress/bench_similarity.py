@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Similarity search over the synthetic patterns: the noisy, shifted,
+and background-offset copies are expected to find their originals;
+then the search over a big random matrix is timed
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+from uuid import uuid4
+
+import numpy as np
+
+import set_path
+from i_data.similarity import Pattern_index
+from i_calculations.xrpd import pattern_serialize, project_pattern
+
+
+NUM_PATTERNS = 500
+NUM_QUERIES = 100
+NUM_BIG = 100000
+
+rng = np.random.default_rng()
+x = np.linspace(5, 100, 5000)
+
+
+def gen_peaks():
+    return [(rng.uniform(10, 90), rng.uniform(10, 100)) for _ in range(rng.integers(5, 30))]
+
+
+def gen_pattern(peaks, shift=0.0, noise=0.0, background=0.0):
+    y = np.full(len(x), float(background))
+    for center, height in peaks:
+        y += height * np.exp(-((x - center - shift) ** 2) / 0.005)
+    return y + noise * rng.random(len(x))
+
+
+tmp_dir = tempfile.mkdtemp()
+index = Pattern_index(os.path.join(tmp_dir, "patterns.idx"))
+
+peaks = [gen_peaks() for _ in range(NUM_PATTERNS)]
+uuids = [str(uuid4()) for _ in peaks]
+
+start = time.perf_counter()
+index.add([(uuid, pattern_serialize(x, gen_pattern(item))) for uuid, item in zip(uuids, peaks)])
+logging.warning("Indexed %s patterns in %.2f s" % (NUM_PATTERNS, time.perf_counter() - start))
+
+for metric in ("cosine", "pearson"):
+    found = 0
+    for n in range(NUM_QUERIES):
+        query = project_pattern(x, gen_pattern(peaks[n], shift=0.05, noise=5, background=10))
+        found += index.search(query, limit=1, metric=metric)[0][0] == uuids[n]
+    logging.warning("%s: %s of %s originals found" % (metric, found, NUM_QUERIES))
+
+index.drop(uuids[:NUM_QUERIES])
+query = project_pattern(x, gen_pattern(peaks[0]))
+assert uuids[0] not in [uuid for uuid, _ in index.search(query, limit=10)]
+
+vectors = np.abs(rng.standard_normal((NUM_BIG, len(index.grid)))).astype(np.float32)
+vectors /= np.linalg.norm(vectors, axis=1)[:, None]
+rows = np.zeros(NUM_BIG, dtype=index.dtype)
+rows["uuid"] = rng.integers(1, 256, (NUM_BIG, 16), dtype=np.uint8)
+rows["vector"] = vectors
+big = Pattern_index(os.path.join(tmp_dir, "big.idx"))
+rows.tofile(big.path)
+
+start = time.perf_counter()
+big.stats()
+logging.warning("Loaded %s vectors in %.2f s" % (NUM_BIG, time.perf_counter() - start))
+
+for metric in ("cosine", "pearson"):
+    start = time.perf_counter()
+    big.search(vectors[0], limit=10, metric=metric)
+    logging.warning("%s search in %.3f s" % (metric, time.perf_counter() - start))
+
+shutil.rmtree(tmp_dir)
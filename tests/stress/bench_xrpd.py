@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Vectorized XRPD pattern reading vs. the former line-by-line one;
+the results are also checked to be identical within float32 precision,
+the packed patterns are decoded by windows, and the decimated previews
+are checked to keep the integrated intensity
+"""
+import os
+import time
+import random
+import logging
+import tempfile
+
+import numpy as np
+
+import set_path
+from i_calculations.xrpd import (
+    get_pattern,
+    read_pattern,
+    pattern_unserialize,
+    pattern_serialize,
+    decimate_pattern,
+    integrate,
+    MAX_PATTERN_POINTS,
+    DECIMATION_TOLERANCE,
+)
+
+
+def get_pattern_by_lines(resource):
+    output = []
+
+    try:
+        f = open(resource)
+    except OSError:
+        for line in resource.splitlines():
+            if line.startswith("END"):
+                break
+            try:
+                output.append([float(item) for item in line.split(maxsplit=1)])
+            except ValueError:
+                continue
+
+    else:
+        while True:
+            line = f.readline()
+            if not line or line.startswith("END"):
+                break
+            try:
+                output.append([float(item) for item in line.split(maxsplit=1)])
+            except ValueError:
+                continue
+        f.close()
+
+    if output:
+        try:
+            ymax = max([y for _, y in output])
+        except ValueError:
+            return None
+
+        output = [[x, y / ymax * 200] for x, y in output]
+        return output
+
+    return None
+
+
+def gen_columns(num_points, width=0.01):
+    x = np.linspace(5, 120, num_points)
+    y = np.zeros(num_points)
+    for _ in range(50):
+        y += random.random() * 1e4 * np.exp(-(x - random.uniform(5, 120)) ** 2 / width)
+    y += np.random.random(num_points) * 10
+    return x, y
+
+
+def gen_pattern(num_points, header=False, footer=False):
+    x, y = gen_columns(num_points)
+
+    lines = ["%.4f %.3f" % pair for pair in zip(x, y)]
+    if header:
+        lines = ["! TOPAS output", "2theta intensity"] + lines
+    if footer:
+        lines += ["END", "1 2"]
+    return "\n".join(lines) + "\n"
+
+
+def bench(func, resource, num_iters=3):
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        result = func(resource)
+    return result, (time.perf_counter() - start) / num_iters
+
+
+for num_points in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6):
+    content = gen_pattern(num_points, header=True, footer=True)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".xy", delete=False) as tmp:
+        tmp.write(content)
+
+    for resource, kind, func in ((content, "string", get_pattern), (tmp.name, "file", read_pattern)):
+        expected, by_lines = bench(get_pattern_by_lines, resource)
+        result, vectorized = bench(func, resource)
+        assert np.allclose(
+            np.stack(pattern_unserialize(result["payload"]), axis=1), expected, rtol=1e-6, atol=1e-4
+        )
+        logging.warning(
+            "%s points from %s: by lines %.3f s, vectorized %.3f s"
+            % (num_points, kind, by_lines, vectorized)
+        )
+
+    os.unlink(tmp.name)
+
+    x, y = (np.array(column) for column in zip(*expected))
+    for compress in (True, False):
+        payload = pattern_serialize(x, y, compress=compress)
+        start = time.perf_counter()
+        for xmin, xmax in ((None, None), (50, 51), (5, 5.5), (119, None), (200, 300), (60, 59)):
+            window_x, window_y = pattern_unserialize(payload, xmin, xmax)
+            mask = (x >= np.float32(xmin if xmin is not None else -np.inf)) & (
+                x <= np.float32(xmax if xmax is not None else np.inf)
+            )
+            assert np.array_equal(window_x, x[mask].astype("<f4"))
+            assert np.array_equal(window_y, y[mask].astype("<f4"))
+        logging.warning(
+            "%s points, %s bytes %s: windows decoded in %.4f s"
+            % (num_points, len(payload), "compressed" if compress else "raw", time.perf_counter() - start)
+        )
+
+for num_points in (5 * 10 ** 3, 10 ** 5, 10 ** 6):
+    for width in (0.001, 0.01):
+        x, y = gen_columns(num_points, width)
+        start = time.perf_counter()
+        dec_x, dec_y = decimate_pattern(x, y)
+        error = abs(integrate(dec_x, dec_y) / integrate(x, y) - 1)
+        assert len(dec_x) <= MAX_PATTERN_POINTS and dec_y.max() == y.max()
+        assert error <= DECIMATION_TOLERANCE, (num_points, width, error)
+        logging.warning(
+            "%s points, peaks of %s: decimated in %.3f s, integral error %.5f"
+            % (num_points, width, time.perf_counter() - start, error)
+        )
+
+for content in ("", "1 2\n\n3 4", "1\n2", "1 2 3\n4 5 6", "a b\n1 2\nEND\n", "1 2\n3 4 5\n6 7"):
+    result, expected = get_pattern(content), get_pattern_by_lines(content)
+    expected = expected and [[x, round(y, 3)] for x, y in expected]
+    assert (result and result["content"]) == expected, content
+
+logging.warning("Results are identical")
@@ -32,6 +32,35 @@ def gen_data_item(data_type):
     return (meta, content, data_type)
 
 
+def gen_cif(num_atoms):
+    cif_string = """data_metis_bench
+_cell_length_a 10.0(1)
+_cell_length_b 11.0(1)
+_cell_length_c 12.0(1)
+_cell_angle_alpha 90
+_cell_angle_beta 90
+_cell_angle_gamma 90
+_symmetry_space_group_name_H-M 'P 1'
+_symmetry_Int_Tables_number 1
+loop_
+_symmetry_equiv_pos_as_xyz
+x,y,z
+loop_
+_atom_site_label
+_atom_site_type_symbol
+_atom_site_fract_x
+_atom_site_fract_y
+_atom_site_fract_z
+_atom_site_occupancy
+"""
+    for n in range(num_atoms):
+        el = random.choice(common_chem_elements[:80])
+        cif_string += "%s%s %s %.5f(3) %.5f(3) %.5f(3) 1.0\n" % (
+            el, n + 1, el, random.random(), random.random(), random.random()
+        )
+    return cif_string
+
+
 def gen_chem_formula():
     els = set()
     pseudo_formula = ""
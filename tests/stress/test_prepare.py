@@ -26,37 +26,33 @@ ALLOWED_TRANSITIONS = (
 db = get_data_storage()
 used_uuids = {}
 
-for _ in range(FAKE_NODES):
-    selected_dtype = random.choice(
-        (
-            Data_type.calculation,
-            Data_type.structure,
-            Data_type.property,
-            Data_type.pattern,
+fake_items = [
+    gen_data_item(
+        random.choice(
+            (
+                Data_type.calculation,
+                Data_type.structure,
+                Data_type.property,
+                Data_type.pattern,
+            )
         )
     )
-    used_uuids.setdefault(selected_dtype, []).append(
-        db.put_item(*gen_data_item(selected_dtype))
-    )
+    for _ in range(FAKE_NODES)
+]
+for item, new_uuid in zip(fake_items, db.put_items(fake_items)):
+    used_uuids.setdefault(item[2], []).append(new_uuid)
 
-count_links, num_iters = 0, 0
+fake_links = set()
 
-while True:
+for _ in range(FAKE_LINKS * 3):
     source_dtype, target_dtype = random.choice(ALLOWED_TRANSITIONS)
-    source, target = random.choice(used_uuids[source_dtype]), random.choice(
-        used_uuids[target_dtype]
+    fake_links.add(
+        (random.choice(used_uuids[source_dtype]), random.choice(used_uuids[target_dtype]))
     )
-
-    if db.put_link(source, target):
-        count_links += 1
-    # else:
-    #    logging.warning('Duplicate link between %s and %s occured on %s-th step' % (source, target, count_links))
-
-    if count_links == FAKE_LINKS:
+    if len(fake_links) == FAKE_LINKS:
         break
 
-    num_iters += 1
-    if num_iters > FAKE_LINKS * 3:
-        break
+count_links = sum(db.put_links(list(fake_links)))
+logging.warning("Created %s nodes and %s links" % (FAKE_NODES, count_links))
 
 db.close()
@@ -4,9 +4,14 @@ import uuid
 from functools import wraps
 from configparser import ConfigParser
 
-from flask import Response, current_app, request
+from flask import Response, current_app, request, g, has_app_context
 
 from i_data import Data_storage
+from i_data.pool import Data_storage_pool
+from i_data.cache import Node_cache
+from i_data.similarity import Pattern_index
+from i_structures.struct_utils import ase_unserialize
+from i_structures.workers import Worker_pool
 
 
 CONFIG_PATH = os.path.realpath(os.path.join(os.path.dirname(__file__), 'conf/env.ini'))
@@ -19,16 +24,81 @@ WEBHOOK_KEY =         config.get('webhooks', 'key')
 WEBHOOK_CALC_UPDATE = config.get('webhooks', 'calc_update')
 WEBHOOK_CALC_CREATE = config.get('webhooks', 'calc_create')
 
+def get_local_path(section, option):
+    """
+    NB a relative path is resolved against the project root
+    """
+    path = config.get(section, option, fallback=None)
+    return os.path.join(os.path.dirname(os.path.dirname(CONFIG_PATH)), path) if path else None
+
+
+node_cache = Node_cache(
+    max_bytes=config.getint('cache', 'max_bytes', fallback=64 * 1024 * 1024),
+    path=get_local_path('cache', 'shared_path'),
+)
+
+refine_cache = Node_cache(
+    max_bytes=config.getint('refine_cache', 'max_bytes', fallback=32 * 1024 * 1024),
+    path=get_local_path('refine_cache', 'shared_path'),
+)
+REFINE_CACHE_PERSIST = config.getboolean('refine_cache', 'persist', fallback=False)
+
+SIMILARITY_INDEX = get_local_path('local', 'similarity_index')
+pattern_index = Pattern_index(SIMILARITY_INDEX) if SIMILARITY_INDEX else None
+
+pool = Data_storage_pool(
+    size=config.getint('db_pool', 'size', fallback=10),
+    max_lifetime=config.getfloat('db_pool', 'max_lifetime', fallback=3600),
+    timeout=config.getfloat('db_pool', 'timeout', fallback=10),
+    ping_after=config.getfloat('db_pool', 'ping_after', fallback=30),
+    cache=node_cache,
+    patterns=pattern_index,
+    **dict(config.items('db'))
+)
+
+workers = Worker_pool(
+    size=config.getint('workers', 'size', fallback=os.cpu_count()),
+    queue_size=config.getint('workers', 'queue_size', fallback=64),
+    timeout=config.getfloat('workers', 'timeout', fallback=30),
+)
+
 
 def get_data_storage():
     """
-    Persistence layer, to be used throughout the codebase
+    Persistence layer, to be used throughout the codebase;
+    within a request, a pooled connection is borrowed once
+    and is returned by the release_data_storage teardown
     """
+    if has_app_context():
+        if 'db' not in g:
+            g.db = pool.checkout()
+        return g.db
+
     return Data_storage(
+        patterns=pattern_index,
         **dict(config.items('db'))
     )
 
 
+def release_data_storage(exc=None):
+    """
+    Flask teardown, returning a borrowed connection to the pool
+    """
+    db = g.pop('db', None)
+    if db:
+        pool.checkin(db)
+
+
+def get_ase(node):
+    """
+    Structure of a node, decoded only once, since the nodes are immutable;
+    a copy is returned, so it can be freely modified
+    """
+    return node_cache.get_decoded(
+        node["uuid"], ase_unserialize, node["payload"] or node["content"]
+    ).copy()
+
+
 def key_auth(f):
     """
     Flask auth decorator